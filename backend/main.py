@@ -6,20 +6,34 @@ Private RAG API Server - Enterprise Grade
 """
 import os
 import io
+import re
 import time
 import json
+import gzip
 import logging
 import sqlite3
 import traceback
 from pathlib import Path
-from typing import List, Optional, Dict, Any, Iterable, AsyncGenerator
+from typing import List, Optional, Dict, Any, Iterable, AsyncGenerator, Tuple, Union, Callable
 from datetime import datetime
 import uuid
 import shutil
+import hashlib
+import threading
+import math
+import heapq
+import bisect
+import functools
+import unicodedata
 import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
 from contextlib import asynccontextmanager
 
 import httpx
+import numpy as np
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query, status, Body
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -28,7 +42,10 @@ from pydantic import BaseModel, Field, validator
 
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import (
-    Distance, VectorParams, Filter, FieldCondition, MatchValue, FilterSelector
+    Distance, VectorParams, Filter, FieldCondition, MatchValue, MatchAny, FilterSelector, PointIdsList,
+    ScoredPoint, HnswConfigDiff, SearchParams, QuantizationSearchParams, VectorParamsDiff, Disabled,
+    ScalarQuantization, ScalarQuantizationConfig, ScalarType, BinaryQuantization, BinaryQuantizationConfig,
+    PayloadSchemaType, IsEmptyCondition, PayloadField
 )
 from fastembed import TextEmbedding
 
@@ -38,15 +55,98 @@ QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "documents")
 
+# 컬렉션 프로필: 양자화, 원본 벡터 디스크 보관, HNSW 파라미터 (임베디드 모드는 항상 전수 검색이라 원격 Qdrant에만 적용)
+COLLECTION_PROFILES = {
+    # 원본 float32 벡터와 HNSW 그래프 모두 RAM (기존 동작)
+    "default": {"quantization": None, "on_disk": False, "hnsw_on_disk": False, "m": 16, "ef_construct": 100, "ef": 100, "oversampling": 1.0},
+    # int8 양자화 벡터만 RAM, 원본은 디스크에서 읽어 재채점 — 벡터 메모리 약 1/4
+    "scalar": {"quantization": "scalar", "on_disk": True, "hnsw_on_disk": False, "m": 16, "ef_construct": 128, "ef": 128, "oversampling": 2.0},
+    # scalar + HNSW 그래프도 디스크 — 한 노드에 수천만 청크
+    "scalar-disk": {"quantization": "scalar", "on_disk": True, "hnsw_on_disk": True, "m": 16, "ef_construct": 128, "ef": 128, "oversampling": 2.0},
+    # 1비트 양자화 — 벡터 메모리 약 1/32, 768차원 이상 임베딩 권장 (재채점 후보를 더 넉넉히)
+    "binary": {"quantization": "binary", "on_disk": True, "hnsw_on_disk": False, "m": 16, "ef_construct": 128, "ef": 192, "oversampling": 3.0},
+}
+COLLECTION_PROFILE = os.getenv("COLLECTION_PROFILE", "default")
+if COLLECTION_PROFILE not in COLLECTION_PROFILES:
+    raise ValueError(f"Unknown COLLECTION_PROFILE '{COLLECTION_PROFILE}', expected one of {sorted(COLLECTION_PROFILES)}")
+for _key, _env, _cast in (("m", "HNSW_M", int), ("ef_construct", "HNSW_EF_CONSTRUCT", int),
+                          ("ef", "HNSW_EF", int), ("oversampling", "QUANT_OVERSAMPLING", float)):
+    if os.getenv(_env):  # 프로필 값을 개별 환경 변수로 덮어쓰기
+        COLLECTION_PROFILES[COLLECTION_PROFILE][_key] = _cast(os.getenv(_env))
+
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "localhost")
 OLLAMA_PORT = int(os.getenv("OLLAMA_PORT", "11434"))
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
-OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "180"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))  # TCP 연결
+OLLAMA_FIRST_BYTE_TIMEOUT = float(os.getenv("OLLAMA_FIRST_BYTE_TIMEOUT", os.getenv("OLLAMA_TIMEOUT", "180")))  # 요청 후 첫 토큰까지 (모델 로딩 포함)
+OLLAMA_IDLE_TIMEOUT = float(os.getenv("OLLAMA_IDLE_TIMEOUT", "60"))  # 토큰 사이 최대 간격
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_KEEPALIVE_CONNECTIONS = int(os.getenv("OLLAMA_KEEPALIVE_CONNECTIONS", "16"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "2"))  # 모델별 동시 생성 수 기본값
+
+def _env_model_map(name: str, cast=int) -> Dict[str, Any]:
+    """Parse "model=value,model=value" (model names may contain ':')"""
+    parsed = {}
+    for model, _, value in (item.rpartition("=") for item in os.getenv(name, "").split(",")):
+        if not model.strip() or not value.strip():
+            continue
+        try:
+            parsed[model.strip()] = cast(value.strip())
+        except ValueError:
+            continue
+    return parsed
+
+LLM_MODEL_CONCURRENCY = _env_model_map("LLM_MODEL_CONCURRENCY")  # 예: "llama3.1:8b=1,qwen2.5:14b=1"
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "4096"))  # 모델 컨텍스트 창, 요청마다 Ollama num_ctx로 전송
+LLM_MODEL_CONTEXT = _env_model_map("LLM_MODEL_CONTEXT")  # 모델별 컨텍스트 창, 예: "llama3.1:8b=8192"
+LLM_ANSWER_TOKENS = int(os.getenv("LLM_ANSWER_TOKENS", "1024"))  # 답변 생성을 위해 남겨둘 토큰
+LLM_QUEUE_MAX = int(os.getenv("LLM_QUEUE_MAX", "32"))  # 모델별 최대 대기 요청 수, 초과 시 429
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))  # 대기열 최대 대기 시간(초), 초과 시 503
+OLLAMA_PRELOAD = [m.strip() for m in os.getenv("OLLAMA_PRELOAD", OLLAMA_MODEL).split(",") if m.strip()]  # 시작 시 미리 올릴 모델, 빈 값이면 끔
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # 마지막 요청 후 모델을 메모리에 유지할 시간 ("-1"이면 계속 유지)
+OLLAMA_MODEL_KEEP_ALIVE = _env_model_map("OLLAMA_MODEL_KEEP_ALIVE", str)  # 모델별 keep_alive, 예: "llama3.1:8b=-1,qwen2.5:14b=5m"
 
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "600"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "250"))
+CHUNKER = os.getenv("CHUNKER", "sentence")  # sentence: 토큰/문장 기반, fixed: 기존 문자 슬라이딩 윈도우
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "256"))  # sentence 청커의 청크당 최대 임베딩 토큰 수
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+TABLE_CHUNK_ROWS = int(os.getenv("TABLE_CHUNK_ROWS", "10"))  # CSV/XLSX 청크당 최대 행 수
+TABLE_CHUNK_CHARS = int(os.getenv("TABLE_CHUNK_CHARS", "1500"))  # CSV/XLSX 청크당 최대 문자 수 (헤더 제외)
 FASTEMBED_BATCH = int(os.getenv("FASTEMBED_BATCH", "256"))
 UPSERT_BATCH = int(os.getenv("UPSERT_BATCH", "5000"))
+UPSERT_PARALLEL = int(os.getenv("UPSERT_PARALLEL", "2"))  # 동시에 업로드할 윈도우 수 (원격 Qdrant만, 로컬은 1)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "1024"))  # 0이면 임베딩 캐시 비활성화
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "2048"))  # 질문 임베딩 LRU 항목 수, 0이면 비활성화
+QUERY_CACHE_TTL = int(os.getenv("QUERY_CACHE_TTL", "3600"))  # 초, 0이면 만료 없음
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))  # RAG 답변 캐시 항목 수, 0이면 비활성화
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))  # 초, 0이면 만료 없음
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))  # 0이면 정확히 같은 질문만, 예: 0.95
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "2"))  # 요청 경로에서 동시에 실행할 임베딩 수
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", "8"))  # 요청 경로에서 동시에 실행할 Qdrant 호출 수 (원격 Qdrant만, 임베디드는 1)
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"  # 벡터 검색 + BM25 키워드 검색 RRF 결합
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "4"))  # 각 검색기에서 top_k의 몇 배를 후보로 가져올지
+RRF_K = int(os.getenv("RRF_K", "60"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+LEXICAL_MAX_DF = float(os.getenv("LEXICAL_MAX_DF", "0.5"))  # 이 비율보다 많은 청크에 나오는 용어는 흔한 용어로 취급
+LEXICAL_MAX_DF_MIN_DOCS = int(os.getenv("LEXICAL_MAX_DF_MIN_DOCS", "1000"))  # 색인된 청크가 이보다 적으면 LEXICAL_MAX_DF 미적용
+LEXICAL_MAX_POSTINGS = int(os.getenv("LEXICAL_MAX_POSTINGS", "20000"))  # 이보다 많은 청크에 나오는 용어도 흔한 용어로 취급
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "32"))  # 한 번에 임베딩할 최대 질문 수
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))  # 배치를 모으는 최대 대기 시간
+INGEST_WINDOW = int(os.getenv("INGEST_WINDOW", "512"))  # 임베딩/업서트 단위 청크 수
+INGEST_QUEUE_DEPTH = int(os.getenv("INGEST_QUEUE_DEPTH", "4"))  # 단계 간 대기 가능한 윈도우 수
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))  # 0이면 스레드에서 파싱
+PARSE_TIMEOUT = int(os.getenv("PARSE_TIMEOUT", "300"))  # 파일당 파싱 제한 시간(초)
+PARSE_MAX_TASKS_PER_CHILD = int(os.getenv("PARSE_MAX_TASKS_PER_CHILD", "100"))
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "2"))  # 동시에 실행되는 인제스트 작업 수 (원격 Qdrant만, 임베디드는 1)
+INGEST_JOB_QUEUE = int(os.getenv("INGEST_JOB_QUEUE", "100"))  # 대기열 최대 작업 수
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", "200"))  # 보관할 완료 작업 수
+JOB_PROGRESS_INTERVAL = float(os.getenv("JOB_PROGRESS_INTERVAL", "1.0"))
+UPLOAD_BLOCK_SIZE = int(os.getenv("UPLOAD_BLOCK_SIZE", str(1024 * 1024)))  # 업로드 스트리밍 블록 크기(바이트)
+UPLOAD_MAX_FILE_MB = int(os.getenv("UPLOAD_MAX_FILE_MB", "2048"))  # 파일당 최대 크기, 0이면 무제한
+UPLOAD_MAX_TOTAL_MB = int(os.getenv("UPLOAD_MAX_TOTAL_MB", "8192"))  # 요청당 최대 크기, 0이면 무제한
 
 # 경로 설정
 BASE_DIR = Path(__file__).parent.resolve()
@@ -55,10 +155,17 @@ DEFAULT_DATA_DIR = (PROJECT_ROOT / "data").resolve()
 EXPORT_DIR = (PROJECT_ROOT / "exports").resolve()
 QDRANT_DIR = (PROJECT_ROOT / "qdrant_storage").resolve()
 CHAT_HISTORY_DIR = (PROJECT_ROOT / "chat_history").resolve()
+INDEX_STATE_DIR = (PROJECT_ROOT / "index_state").resolve()
+STATE_DB_PATH = INDEX_STATE_DIR / "index_state.db"
+SPOOL_DIR = INDEX_STATE_DIR / "spool"
+EMBED_CACHE_DB_PATH = INDEX_STATE_DIR / "embedding_cache.db"
+LEXICAL_DB_PATH = INDEX_STATE_DIR / "lexical_index.db"
+CHUNK_DB_PATH = INDEX_STATE_DIR / "chunk_store.db"
+DOC_TEXT_DIR = INDEX_STATE_DIR / "documents"  # 추출 텍스트 (gzip, 파일 해시별)
 
 CURRENT_DATA_DIR: Path = DEFAULT_DATA_DIR
 
-for d in (DEFAULT_DATA_DIR, EXPORT_DIR, QDRANT_DIR, CHAT_HISTORY_DIR):
+for d in (DEFAULT_DATA_DIR, EXPORT_DIR, QDRANT_DIR, CHAT_HISTORY_DIR, INDEX_STATE_DIR, SPOOL_DIR, DOC_TEXT_DIR):
     d.mkdir(parents=True, exist_ok=True)
 
 # 로깅 설정
@@ -74,25 +181,97 @@ log = logging.getLogger("private-rag")
 
 # ==================== 전역 변수 ====================
 _qdrant: Optional[QdrantClient] = None
+_qdrant_lock = threading.RLock()  # 임베디드 Qdrant 호출 직렬화
 _embedding_model = None
 _ollama_available = False
 _available_models = []
+_ollama_client: Optional[httpx.AsyncClient] = None
+_model_keep_alive: Dict[str, str] = {}  # 관리 API로 지정한 모델별 keep_alive (설정값보다 우선)
+_llm_scheduler: Optional["LLMScheduler"] = None
+_parse_pool: Optional[ProcessPoolExecutor] = None
+_embed_executor: Optional[ThreadPoolExecutor] = None
+_search_executor: Optional[ThreadPoolExecutor] = None
+_query_batcher: Optional["QueryEmbedBatcher"] = None
+_lexical_db: Optional[sqlite3.Connection] = None
+_lexical_lock = threading.RLock()
+_lexical_stats = {"docs": 0, "length": 0}
+_chunk_db: Optional[sqlite3.Connection] = None
+_chunk_lock = threading.RLock()
+_collection_state: Optional[Dict[str, Any]] = None  # {"exists", "dim"}, 생성/삭제 시 갱신
+_collection_lock = threading.RLock()
+_embedding_dim: Optional[int] = None
+_chunk_tokenizer = None
+_state_db: Optional[sqlite3.Connection] = None
+_state_lock = threading.RLock()
+_embed_cache_db: Optional[sqlite3.Connection] = None
+_embed_cache_lock = threading.Lock()
+_embed_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+_query_cache: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+_query_cache_lock = threading.Lock()
+_query_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+_answer_cache: "OrderedDict[Tuple, Dict[str, Any]]" = OrderedDict()
+_answer_cache_lock = threading.Lock()
+_answer_cache_stats = {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0}
+_index_version = 0  # 컬렉션 내용이 바뀔 때마다 증가, 답변 캐시 키에 포함
+_jobs: Dict[str, "IngestJob"] = {}
+_job_queue: Optional[asyncio.Queue] = None
+_job_workers: List[asyncio.Task] = []
+_started_at = time.time()  # 이보다 먼저 저장된 추출 텍스트만 고아 정리 대상
 
 # ==================== Lifespan ====================
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     log.info("🚀 Starting Private RAG API Server (Fabrix Edition)...")
+    for stale in (*SPOOL_DIR.glob("*.jsonl"), *SPOOL_DIR.glob("*.txt.gz")):
+        stale.unlink(missing_ok=True)
+    get_ollama_client()
+    background: List[asyncio.Task] = []  # 종료 시 취소할 시작 작업
     try:
         await check_ollama_connection()
         await load_available_models()
+        if OLLAMA_PRELOAD:
+            # 첫 질문이 모델 로딩 시간을 떠안지 않도록 백그라운드에서 미리 올림
+            background.append(asyncio.create_task(preload_models(OLLAMA_PRELOAD)))
         await initialize_embedding_model()
+        if not QDRANT_LOCAL and await has_collection():
+            drift = await run_qdrant(collection_profile_drift)
+            if drift:
+                log.warning(
+                    f"Collection '{COLLECTION_NAME}' does not match profile '{COLLECTION_PROFILE}' {drift}; "
+                    f"POST /admin/collection/migrate to convert it"
+                )
         log.info("✅ All systems initialized successfully")
     except Exception as e:
         log.error(f"⚠️ Initialization warning: {e}")
+    async def upgrade_indexes():
+        try:
+            # 이전 버전이 만든 컬렉션을 먼저 변환 (payload 색인, 본문을 청크 저장소로 이동)
+            await asyncio.to_thread(upgrade_collection)
+            if HYBRID_SEARCH:
+                # 키워드 색인이 없거나 어긋나 있으면 청크 저장소에서 재구축
+                await asyncio.to_thread(sync_lexical_index)
+        except Exception as e:
+            log.error(f"Index upgrade failed: {e}\n{traceback.format_exc()}")
+    background.append(asyncio.create_task(upgrade_indexes()))
 
     yield
 
     log.info("🛑 Shutting down Private RAG API Server...")
+    for task in background:
+        task.cancel()
+    for job in list(_jobs.values()):
+        cancel_ingest_job(job)
+    for worker in _job_workers:
+        worker.cancel()
+    reset_parse_pool(_parse_pool)
+    if _query_batcher is not None:
+        for task in (_query_batcher.task, *_query_batcher.dispatching):
+            if task is not None:
+                task.cancel()
+    for executor in (_embed_executor, _search_executor):
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+    await close_ollama_client()
 
 # ==================== FastAPI ====================
 app = FastAPI(
@@ -134,17 +313,38 @@ def root():
     return {"status": "ok", "message": "Private RAG API Server - Fabrix Edition", "version": "3.0.0"}
 
 # ==================== 헬퍼 함수 ====================
+def get_ollama_client() -> httpx.AsyncClient:
+    """Application-wide keep-alive connection pool to Ollama"""
+    global _ollama_client
+    if _ollama_client is None or _ollama_client.is_closed:
+        _ollama_client = httpx.AsyncClient(
+            base_url=f"http://{OLLAMA_HOST}:{OLLAMA_PORT}",
+            # 읽기 타임아웃은 call_ollama_stream에서 첫 토큰/토큰 간격으로 따로 관리
+            timeout=httpx.Timeout(connect=OLLAMA_CONNECT_TIMEOUT, read=None, write=30.0, pool=OLLAMA_FIRST_BYTE_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=OLLAMA_MAX_CONNECTIONS,
+                max_keepalive_connections=OLLAMA_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=60.0
+            ),
+        )
+    return _ollama_client
+
+async def close_ollama_client():
+    global _ollama_client
+    if _ollama_client is not None:
+        await _ollama_client.aclose()
+        _ollama_client = None
+
 async def check_ollama_connection(retries: int = 3, delay: float = 1.0) -> bool:
     """Check Ollama connection with retry logic"""
     global _ollama_available
     for attempt in range(retries):
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                r = await client.get(f"http://{OLLAMA_HOST}:{OLLAMA_PORT}/api/tags")
-                _ollama_available = r.status_code == 200
-                if _ollama_available:
-                    log.info("✅ Ollama connection successful")
-                return _ollama_available
+            r = await get_ollama_client().get("/api/tags", timeout=5.0)
+            _ollama_available = r.status_code == 200
+            if _ollama_available:
+                log.info("✅ Ollama connection successful")
+            return _ollama_available
         except Exception as e:
             if attempt < retries - 1:
                 log.warning(f"Ollama connection attempt {attempt + 1}/{retries} failed: {e}")
@@ -159,13 +359,12 @@ async def load_available_models(retries: int = 3):
     global _available_models
     for attempt in range(retries):
         try:
-            async with httpx.AsyncClient(timeout=5.0) as client:
-                r = await client.get(f"http://{OLLAMA_HOST}:{OLLAMA_PORT}/api/tags")
-                if r.status_code == 200:
-                    data = r.json()
-                    _available_models = [m["name"] for m in data.get("models", [])]
-                    log.info(f"✅ Available models: {_available_models}")
-                    return
+            r = await get_ollama_client().get("/api/tags", timeout=5.0)
+            if r.status_code == 200:
+                data = r.json()
+                _available_models = [m["name"] for m in data.get("models", [])]
+                log.info(f"✅ Available models: {_available_models}")
+                return
         except Exception as e:
             if attempt < retries - 1:
                 log.warning(f"Model load attempt {attempt + 1}/{retries} failed: {e}")
@@ -174,14 +373,66 @@ async def load_available_models(retries: int = 3):
                 log.warning(f"Failed to load models after {retries} attempts: {e}")
                 _available_models = []
 
+def model_keep_alive(model: str) -> Union[int, str]:
+    """keep_alive sent with every request for the model: admin override, then per-model config, then default"""
+    value = _model_keep_alive.get(model) or OLLAMA_MODEL_KEEP_ALIVE.get(model) or OLLAMA_KEEP_ALIVE
+    # Ollama은 문자열을 Go duration("30m")으로만 해석하므로 초 단위 숫자("-1", "300")는 정수로 보냄
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def model_context_window(model: str) -> int:
+    """Context window the RAG prompt is packed for, sent to Ollama as num_ctx"""
+    return LLM_MODEL_CONTEXT.get(model, LLM_CONTEXT_TOKENS)
+
+async def set_model_residency(model: str, keep_alive: Union[int, str]) -> bool:
+    """Load (or with keep_alive=0 unload) a model without generating anything"""
+    try:
+        r = await get_ollama_client().post(
+            "/api/generate",
+            # num_ctx가 다르면 Ollama가 첫 생성 요청에서 모델을 다시 올리므로 같은 값으로 로드
+            json={"model": model, "keep_alive": keep_alive, "options": {"num_ctx": model_context_window(model)}},
+            timeout=httpx.Timeout(OLLAMA_FIRST_BYTE_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)
+        )
+    except Exception as e:
+        log.warning(f"Model residency update failed for {model}: {e}")
+        return False
+    if r.status_code != 200:
+        log.warning(f"Model residency update failed for {model}: {r.text[:200]}")
+        return False
+    return True
+
+async def preload_models(models: List[str]):
+    """Warm the given models into Ollama memory with their keep_alive policy"""
+    for model in models:
+        if _available_models and model not in _available_models:
+            log.warning(f"Skipping preload of {model}: not pulled")
+            continue
+        started = time.monotonic()
+        if await set_model_residency(model, model_keep_alive(model)):
+            log.info(f"🔥 Preloaded {model} in {time.monotonic() - started:.1f}s (keep_alive={model_keep_alive(model)})")
+
+async def loaded_models() -> List[Dict[str, Any]]:
+    """Models currently resident in Ollama memory (/api/ps)"""
+    r = await get_ollama_client().get("/api/ps", timeout=5.0)
+    r.raise_for_status()
+    return [
+        {
+            "name": m.get("name"),
+            "size": m.get("size"),
+            "size_vram": m.get("size_vram"),
+            "expires_at": m.get("expires_at")
+        }
+        for m in r.json().get("models", [])
+    ]
+
 async def initialize_embedding_model():
     global _embedding_model
     if _embedding_model is None:
         try:
             log.info("Loading embedding model...")
-            _embedding_model = TextEmbedding(
-                model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
-            )
+            _embedding_model = TextEmbedding(model_name=EMBEDDING_MODEL)
             log.info("✅ Embedding model loaded successfully")
         except Exception as e:
             log.error(f"❌ Failed to load embedding model: {e}")
@@ -195,18 +446,57 @@ def get_embedding_model():
         )
     return _embedding_model
 
+async def run_embedding(fn, *args, **kwargs):
+    """Run a blocking embedding call on the bounded embedding executor"""
+    global _embed_executor
+    if _embed_executor is None:
+        _embed_executor = ThreadPoolExecutor(max_workers=max(1, EMBED_CONCURRENCY), thread_name_prefix="embed")
+    return await asyncio.get_running_loop().run_in_executor(_embed_executor, functools.partial(fn, *args, **kwargs))
+
+async def run_qdrant(fn, *args, **kwargs):
+    """Run a blocking Qdrant call on the bounded search executor (a single thread for embedded Qdrant)"""
+    global _search_executor
+    if _search_executor is None:
+        workers = 1 if QDRANT_LOCAL else max(1, SEARCH_CONCURRENCY)
+        _search_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qdrant")
+    return await asyncio.get_running_loop().run_in_executor(_search_executor, functools.partial(fn, *args, **kwargs))
+
+class SerializedQdrantClient:
+    """QdrantClient proxy that lets one call at a time into the embedded client.
+
+    The embedded client is not thread-safe: a search running beside an upload
+    sees half-updated segment arrays, and two writers collide in its SQLite
+    storage. Every method call therefore holds _qdrant_lock.
+    """
+
+    def __init__(self, client: QdrantClient):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            with _qdrant_lock:
+                return attr(*args, **kwargs)
+        return call
+
 def get_qdrant() -> QdrantClient:
     global _qdrant
     if _qdrant is not None:
         return _qdrant
 
     try:
-        if QDRANT_LOCAL:
-            log.info(f"Using Qdrant Embedded (path={QDRANT_DIR})")
-            _qdrant = QdrantClient(path=str(QDRANT_DIR))
-        else:
-            log.info(f"Using Qdrant Remote ({QDRANT_HOST}:{QDRANT_PORT})")
-            _qdrant = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+        with _qdrant_lock:
+            if _qdrant is None:
+                if QDRANT_LOCAL:
+                    log.info(f"Using Qdrant Embedded (path={QDRANT_DIR})")
+                    _qdrant = SerializedQdrantClient(QdrantClient(path=str(QDRANT_DIR)))
+                else:
+                    log.info(f"Using Qdrant Remote ({QDRANT_HOST}:{QDRANT_PORT})")
+                    _qdrant = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
         return _qdrant
     except Exception as e:
         log.error(f"Failed to initialize Qdrant: {e}")
@@ -331,24 +621,271 @@ def read_file_text(fp: Path) -> str:
         log.error(traceback.format_exc())
         return ""
 
-def ensure_collection(vec_dim: int):
+def get_collection_state(refresh: bool = False) -> Dict[str, Any]:
+    """Cached existence and vector size of COLLECTION_NAME, looked up once per change"""
+    global _collection_state
+    with _collection_lock:
+        if _collection_state is None or refresh:
+            client = get_qdrant()
+            state = {"exists": client.collection_exists(COLLECTION_NAME), "dim": None}
+            if state["exists"]:
+                state["dim"] = client.get_collection(COLLECTION_NAME).config.params.vectors.size
+            _collection_state = state
+        return _collection_state
+
+def collection_exists() -> bool:
+    return get_collection_state()["exists"]
+
+async def has_collection() -> bool:
+    """collection_exists for async handlers; only the first lookup leaves the event loop"""
+    state = _collection_state
+    if state is None:
+        state = await run_qdrant(get_collection_state)
+    return state["exists"]
+
+def invalidate_collection_state():
+    global _collection_state
+    with _collection_lock:
+        _collection_state = None
+
+def _quantization_config(profile: Dict[str, Any]):
+    if profile["quantization"] == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+    if profile["quantization"] == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+def _hnsw_config(profile: Dict[str, Any]) -> HnswConfigDiff:
+    return HnswConfigDiff(m=profile["m"], ef_construct=profile["ef_construct"], on_disk=profile["hnsw_on_disk"])
+
+def collection_search_params() -> SearchParams:
+    """Search-time ef and quantization rescoring for the configured profile"""
+    profile = COLLECTION_PROFILES[COLLECTION_PROFILE]
+    quantization = None
+    if profile["quantization"]:
+        # 양자화 점수로 oversampling배 후보를 뽑고 원본 벡터로 다시 채점
+        quantization = QuantizationSearchParams(rescore=True, oversampling=profile["oversampling"])
+    return SearchParams(hnsw_ef=profile["ef"], quantization=quantization)
+
+# 필터/스크롤/삭제에 쓰이는 payload 필드 — 색인이 없으면 Qdrant 서버가 매번 전체 포인트를 훑음
+PAYLOAD_INDEXES = {
+    "source": PayloadSchemaType.KEYWORD,
+    "filename": PayloadSchemaType.KEYWORD,
+    "file_type": PayloadSchemaType.KEYWORD,
+    "chunk_id": PayloadSchemaType.INTEGER,
+    "indexed_at": PayloadSchemaType.DATETIME,
+}
+
+def create_payload_indexes() -> List[str]:
+    """Create the PAYLOAD_INDEXES the collection does not have yet; return the created fields"""
+    if QDRANT_LOCAL:
+        return []  # 임베디드 Qdrant는 payload 색인을 지원하지 않음
+    client = get_qdrant()
+    existing = client.get_collection(COLLECTION_NAME).payload_schema or {}
+    created = []
+    for field, schema in PAYLOAD_INDEXES.items():
+        if field not in existing:
+            client.create_payload_index(COLLECTION_NAME, field_name=field, field_schema=schema, wait=True)
+            created.append(field)
+    return created
+
+def backfill_manifest() -> int:
+    """Catalog sources whose points predate the manifest, once; return how many were added.
+
+    Points written since the manifest exists always get a row (a mismatch
+    after a failed ingest is not legacy data), so the scan runs on the first
+    start of this version only and is recorded with the catalog_backfilled flag.
+    """
+    if state_flag("catalog_backfilled"):
+        return 0
+    client = get_qdrant()
+    points = client.count(collection_name=COLLECTION_NAME, exact=True).count
+    if points == catalog_totals()["points"]:
+        set_state_flag("catalog_backfilled")
+        return 0
+    counts: Dict[str, int] = {}
+    indexed_at: Dict[str, str] = {}
+    offset = None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=COLLECTION_NAME, limit=1000, offset=offset,
+            with_payload=["source", "indexed_at"], with_vectors=False
+        )
+        for p in batch:
+            pl = p.payload or {}
+            source = pl.get("source", "unknown")
+            counts[source] = counts.get(source, 0) + 1
+            indexed_at[source] = max(indexed_at.get(source, ""), pl.get("indexed_at") or "")
+        if offset is None:
+            break
+    missing = {s: n for s, n in counts.items() if manifest_get(s) is None}
+    manifest_backfill(missing, indexed_at)
+    set_state_flag("catalog_backfilled")
+    return len(missing)
+
+def backfill_file_type() -> int:
+    """Set file_type, added in a later version, from the source extension; return how many sources were updated"""
+    client = get_qdrant()
+    missing = Filter(must=[IsEmptyCondition(is_empty=PayloadField(key="file_type"))])
+    if not client.count(collection_name=COLLECTION_NAME, count_filter=missing, exact=True).count:
+        return 0
+    sources = set()
+    offset = None
+    while True:
+        batch, offset = client.scroll(
+            collection_name=COLLECTION_NAME, scroll_filter=missing, limit=1000, offset=offset,
+            with_payload=["source"], with_vectors=False
+        )
+        sources.update((p.payload or {}).get("source", "") for p in batch)
+        if offset is None:
+            break
+    for source in sources:
+        client.set_payload(
+            collection_name=COLLECTION_NAME,
+            payload={"file_type": Path(source).suffix.lower()},
+            points=Filter(must=[FieldCondition(key="source", match=MatchValue(value=source))]),
+            wait=True
+        )
+    return len(sources)
+
+def upgrade_collection():
+    """Bring a collection indexed by an older version up to date: payload indexes, chunk store, catalog and file_type.
+
+    Each step is independent, so one that fails is logged and the rest still run.
+    Extracted texts left behind by an interrupted run are swept first.
+    """
     try:
-        client = get_qdrant()
-        collections = [c.name for c in client.get_collections().collections]
-        if COLLECTION_NAME not in collections:
-            log.info(f"Creating collection '{COLLECTION_NAME}' (dim={vec_dim})")
-            client.recreate_collection(
+        swept = sweep_document_texts()
+        if swept:
+            log.info(f"✅ Removed {swept} extracted texts no indexed file refers to")
+    except Exception as e:
+        log.warning(f"Extracted text sweep failed: {e}")
+    try:
+        if not collection_exists():
+            return
+    except Exception as e:
+        log.warning(f"Collection upgrade skipped: {e}")
+        return
+    try:
+        created = create_payload_indexes()
+        if created:
+            log.info(f"✅ Created payload indexes: {created}")
+    except Exception as e:
+        log.warning(f"Payload index creation failed: {e}")
+    try:
+        moved = migrate_payload_text()
+        if moved:
+            log.info(f"✅ Moved text of {moved} chunks from Qdrant payloads to the chunk store")
+    except Exception as e:
+        log.warning(f"Moving payload text to the chunk store failed: {e}")
+    try:
+        backfilled = backfill_manifest()
+        if backfilled:
+            log.info(f"✅ Added {backfilled} sources indexed before the manifest to the catalog")
+    except Exception as e:
+        log.warning(f"Catalog backfill failed: {e}")
+    try:
+        typed = backfill_file_type()
+        if typed:
+            log.info(f"✅ Added file_type to points of {typed} sources")
+    except Exception as e:
+        log.warning(f"file_type backfill failed: {e}")
+
+def create_collection(vec_dim: int, profile_name: str = COLLECTION_PROFILE):
+    """(Re)create COLLECTION_NAME empty with the given profile and record it in the registry"""
+    global _collection_state
+    profile = COLLECTION_PROFILES[profile_name]
+    with _collection_lock:
+        try:
+            get_qdrant().recreate_collection(
                 collection_name=COLLECTION_NAME,
-                vectors_config=VectorParams(size=vec_dim, distance=Distance.COSINE),
+                vectors_config=VectorParams(size=vec_dim, distance=Distance.COSINE, on_disk=profile["on_disk"]),
+                hnsw_config=_hnsw_config(profile),
+                quantization_config=_quantization_config(profile),
             )
+            create_payload_indexes()
+        except Exception:
+            _collection_state = None
+            raise
+        _collection_state = {"exists": True, "dim": vec_dim}
+
+def collection_profile_drift(profile_name: str = COLLECTION_PROFILE) -> Dict[str, Any]:
+    """Settings where the existing collection differs from the profile, as {field: [current, wanted]}"""
+    profile = COLLECTION_PROFILES[profile_name]
+    config = get_qdrant().get_collection(COLLECTION_NAME).config
+    quant = config.quantization_config
+    current = {
+        "quantization": "scalar" if isinstance(quant, ScalarQuantization) else "binary" if isinstance(quant, BinaryQuantization) else None,
+        "on_disk": bool(config.params.vectors.on_disk),
+        "hnsw_on_disk": bool(config.hnsw_config.on_disk),
+        "m": config.hnsw_config.m,
+        "ef_construct": config.hnsw_config.ef_construct,
+    }
+    return {key: [value, profile[key]] for key, value in current.items() if value != profile[key]}
+
+def migrate_collection(profile_name: str) -> Dict[str, Any]:
+    """Switch the existing collection to a profile in place.
+
+    Qdrant applies the new vector storage, HNSW and quantization settings by
+    rebuilding segments in the background, so the collection keeps serving
+    searches (status "yellow") while it converts; no re-embedding is needed.
+    """
+    profile = COLLECTION_PROFILES[profile_name]
+    drift = collection_profile_drift(profile_name)
+    if drift:
+        get_qdrant().update_collection(
+            collection_name=COLLECTION_NAME,
+            vectors_config={"": VectorParamsDiff(on_disk=profile["on_disk"])},
+            hnsw_config=_hnsw_config(profile),
+            quantization_config=_quantization_config(profile) or Disabled.DISABLED,
+        )
+        invalidate_collection_state()
+    return drift
+
+def ensure_collection(vec_dim: int):
+    try:
+        state = get_collection_state()
+        if not state["exists"]:
+            log.info(f"Creating collection '{COLLECTION_NAME}' (dim={vec_dim})")
+            create_collection(vec_dim)
+        elif state["dim"] != vec_dim:
+            log.warning(f"Collection '{COLLECTION_NAME}' has dim={state['dim']}, embedding model has dim={vec_dim}")
     except Exception as e:
         log.error(f"Failed to ensure collection: {e}")
         raise HTTPException(status_code=500, detail=f"Collection creation failed: {str(e)}")
 
-def embed_texts_batch(texts: List[str]) -> List[List[float]]:
+def get_embedding_dim() -> int:
+    """Vector size of EMBEDDING_MODEL, from fastembed's model table instead of a probe embedding"""
+    global _embedding_dim
+    if _embedding_dim is None:
+        for desc in TextEmbedding.list_supported_models():
+            if desc["model"].lower() == EMBEDDING_MODEL.lower():
+                _embedding_dim = int(desc["dim"])
+                break
+        else:
+            raise HTTPException(status_code=500, detail=f"Unknown embedding model: {EMBEDDING_MODEL}")
+    return _embedding_dim
+
+def embed_texts_batch(texts: List[str], use_cache: bool = True) -> np.ndarray:
+    """Embed texts into an (n, dim) float32 matrix, reusing vectors from the on-disk cache.
+
+    Questions pass use_cache=False: the cache is for chunk texts that get
+    re-indexed, and repeated questions are served by the in-memory query LRU.
+    """
     try:
         em = get_embedding_model()
-        return [vec for vec in em.embed(texts, batch_size=FASTEMBED_BATCH)]
+        if not use_cache or EMBED_CACHE_MAX_MB <= 0:
+            return np.array(list(em.embed(texts, batch_size=FASTEMBED_BATCH)), dtype=np.float32)
+
+        keys = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+        vectors = embedding_cache_get(keys)
+        # 같은 배치 안의 중복 텍스트(공통 문구 등)는 한 번만 임베딩
+        missing = {k: t for k, t in zip(keys, texts) if k not in vectors}
+        if missing:
+            fresh = dict(zip(missing, em.embed(list(missing.values()), batch_size=FASTEMBED_BATCH)))
+            embedding_cache_put(fresh)
+            vectors.update(fresh)
+        return np.array([vectors[k] for k in keys], dtype=np.float32)
     except Exception as e:
         log.error(f"Embedding failed: {e}")
         raise HTTPException(status_code=500, detail=f"Embedding failed: {str(e)}")
@@ -361,49 +898,66 @@ async def call_ollama_stream(prompt: str, model: str = OLLAMA_MODEL, system: str
         if not await check_ollama_connection(retries=2, delay=0.5):
             raise HTTPException(status_code=503, detail="Ollama is not available. Please ensure Ollama is running.")
 
-    url = f"http://{OLLAMA_HOST}:{OLLAMA_PORT}/api/generate"
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": True
+        "stream": True,
+        "keep_alive": model_keep_alive(model),
+        # build_rag_prompt가 맞춘 창 크기 — 보내지 않으면 Ollama 기본 num_ctx로 잘리거나 남음
+        "options": {"num_ctx": model_context_window(model)}
     }
     if system:
         payload["system"] = system
 
+    client = get_ollama_client()
     last_error = None
+    yielded = False
     for attempt in range(retries + 1):
         try:
-            async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-                async with client.stream("POST", url, json=payload) as resp:
-                    if resp.status_code != 200:
-                        text = await resp.aread()
-                        error_msg = text.decode(errors='ignore')
-
-                        # Check if model not found
-                        if "model" in error_msg.lower() and "not found" in error_msg.lower():
-                            raise HTTPException(
-                                status_code=404,
-                                detail=f"Model '{model}' not found. Please pull it first: ollama pull {model}"
-                            )
-
-                        raise HTTPException(status_code=502, detail=f"Ollama error: {error_msg}")
-
-                    async for line in resp.aiter_lines():
-                        if not line:
-                            continue
-                        try:
-                            obj = json.loads(line)
-                            if obj.get("response"):
-                                yield obj["response"]
-                            if obj.get("done"):
-                                return  # Successful completion
-                        except json.JSONDecodeError:
-                            continue
-                    return  # Stream ended successfully
-
-        except httpx.TimeoutException as e:
+            started = time.monotonic()
+            request = client.build_request("POST", "/api/generate", json=payload)
+            resp = await asyncio.wait_for(client.send(request, stream=True), OLLAMA_FIRST_BYTE_TIMEOUT)
+            try:
+                if resp.status_code != 200:
+                    text = await resp.aread()
+                    error_msg = text.decode(errors='ignore')
+
+                    # Check if model not found
+                    if "model" in error_msg.lower() and "not found" in error_msg.lower():
+                        raise HTTPException(
+                            status_code=404,
+                            detail=f"Model '{model}' not found. Please pull it first: ollama pull {model}"
+                        )
+
+                    raise HTTPException(status_code=502, detail=f"Ollama error: {error_msg}")
+
+                # 첫 토큰은 모델 로딩/프롬프트 처리 시간까지, 이후에는 토큰 사이 간격만 기다림
+                lines = resp.aiter_lines()
+                wait = max(0.1, OLLAMA_FIRST_BYTE_TIMEOUT - (time.monotonic() - started))
+                while True:
+                    try:
+                        line = await asyncio.wait_for(lines.__anext__(), wait)
+                    except StopAsyncIteration:
+                        return  # Stream ended successfully
+                    if not line:
+                        continue
+                    try:
+                        obj = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if obj.get("response"):
+                        wait = OLLAMA_IDLE_TIMEOUT
+                        yielded = True
+                        yield obj["response"]
+                    if obj.get("done"):
+                        return  # Successful completion
+            finally:
+                await resp.aclose()
+
+        except (httpx.TimeoutException, asyncio.TimeoutError) as e:
             last_error = e
-            if attempt < retries:
+            # 이미 토큰을 내보낸 뒤에는 재시도하면 답변이 중복되므로 중단
+            if attempt < retries and not yielded:
                 log.warning(f"Ollama timeout, retry {attempt + 1}/{retries}")
                 await asyncio.sleep(1.0)
                 continue
@@ -411,7 +965,7 @@ async def call_ollama_stream(prompt: str, model: str = OLLAMA_MODEL, system: str
 
         except httpx.ConnectError as e:
             last_error = e
-            if attempt < retries:
+            if attempt < retries and not yielded:
                 log.warning(f"Ollama connection error, retry {attempt + 1}/{retries}")
                 await check_ollama_connection(retries=1, delay=0.5)  # Try to reconnect
                 await asyncio.sleep(1.0)
@@ -423,7 +977,7 @@ async def call_ollama_stream(prompt: str, model: str = OLLAMA_MODEL, system: str
 
         except Exception as e:
             last_error = e
-            if attempt < retries:
+            if attempt < retries and not yielded:
                 log.warning(f"Ollama error, retry {attempt + 1}/{retries}: {e}")
                 await asyncio.sleep(1.0)
                 continue
@@ -434,38 +988,2236 @@ async def call_ollama_stream(prompt: str, model: str = OLLAMA_MODEL, system: str
     if last_error:
         raise HTTPException(status_code=502, detail=f"Failed after {retries + 1} attempts: {str(last_error)}")
 
-def build_rag_prompt(question: str, contexts: List[Dict[str, Any]], language: str = "ko") -> str:
-    sources_text = "\n\n".join([
-        f"[{i+1}] {(c.get('payload') or {}).get('filename', 'unknown')}\n{(c.get('payload') or {}).get('text', '')[:1500]}"
-        for i, c in enumerate(contexts)
-    ])
+def merge_chunk_texts(prev: Dict[str, Any], payload: Dict[str, Any]) -> str:
+    """Join the next chunk of a source onto a passage without repeating their overlap"""
+    text = payload.get("text", "")
+    prev_text = prev["text"]
+    if prev.get("char_end") is not None and payload.get("char_start") is not None:
+        overlap = prev["char_end"] - payload["char_start"]
+        return prev_text + text[overlap:] if overlap > 0 else prev_text + "\n" + text
+    # 오프셋이 없는 이전 색인: 앞 청크의 꼬리와 일치하는 가장 긴 접두부를 찾음
+    probe = text[:32]
+    pos = prev_text.find(probe, max(0, len(prev_text) - len(text))) if probe else -1
+    while pos != -1:
+        if text.startswith(prev_text[pos:]):
+            return prev_text[:pos] + text
+        pos = prev_text.find(probe, pos + 1)
+    return prev_text + "\n" + text
+
+def pack_contexts(contexts: List[Dict[str, Any]], budget: int) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """Merge consecutive chunks of each source, then fill `budget` tokens with passages by score"""
+    by_source: Dict[str, List[Dict[str, Any]]] = {}
+    for c in contexts:
+        by_source.setdefault((c.get("payload") or {}).get("source", "unknown"), []).append(c)
+
+    passages: List[Dict[str, Any]] = []
+    for items in by_source.values():
+        items.sort(key=lambda c: (c.get("payload") or {}).get("chunk_id", 0))
+        run = None
+        for c in items:
+            pl = c.get("payload") or {}
+            chunk_id = pl.get("chunk_id", 0)
+            # CSV/XLSX 청크는 각자 헤더를 가진 독립 블록이므로 합치지 않음
+            if run is not None and chunk_id == run["last_id"] + 1 and "row_start" not in pl:
+                run["text"] = merge_chunk_texts(run, pl)
+                run["score"] = max(run["score"], c.get("score", 0.0))
+                run["last_id"] = chunk_id
+                run["chunks"] += 1
+                run["char_end"] = pl.get("char_end")
+                run["page_end"] = pl.get("page_end", run["page_end"])
+                continue
+            run = {
+                "filename": pl.get("filename", "unknown"),
+                "text": pl.get("text", ""),
+                "score": c.get("score", 0.0),
+                "last_id": chunk_id,
+                "chunks": 1,
+                "char_end": pl.get("char_end"),
+                "page_start": pl.get("page_start"),
+                "page_end": pl.get("page_end"),
+            }
+            passages.append(run)
+
+    passages.sort(key=lambda p: -p["score"])
+    sizes = count_tokens([p["text"] for p in passages]) if passages else []
+    selected = []
+    used = 0
+    dropped = 0
+    for p, n in zip(passages, sizes):
+        room = budget - used
+        if n > room:
+            if room < 64:
+                dropped += p["chunks"]
+                continue
+            # 예산에 맞게 뒷부분을 잘라서라도 가장 관련 있는 구절은 포함
+            while n > room:
+                p["text"] = p["text"][:max(1, len(p["text"]) * room // (n + 1))]
+                n = count_tokens([p["text"]])[0]
+        selected.append(p)
+        used += n
+
+    stats = {
+        "chunks": len(contexts),
+        "passages": len(selected),
+        "chunks_merged": len(contexts) - len(passages),
+        "chunks_dropped": dropped,
+        "context_tokens": used,
+        "budget_tokens": budget,
+    }
+    return selected, stats
 
+def rag_system_prompt(language: str = "ko") -> str:
+    """Fixed RAG instructions, sent as Ollama's system prompt"""
     if language == "ko":
-        system = (
+        return (
             "당신은 문서 기반 질문에 답하는 AI 어시스턴트입니다. "
             "주어진 문서 컨텍스트만을 사용하여 정확하고 상세하게 답변하세요. "
             "정보가 불확실하면 모른다고 말하세요."
         )
-    else:
-        system = (
-            "You are an AI assistant that answers questions based on documents. "
-            "Use ONLY the provided context to answer accurately and in detail. "
-            "If unsure, say you don't know."
-        )
+    return (
+        "You are an AI assistant that answers questions based on documents. "
+        "Use ONLY the provided context to answer accurately and in detail. "
+        "If unsure, say you don't know."
+    )
 
-    return f"""{system}
+def build_rag_prompt(
+    question: str,
+    contexts: List[Dict[str, Any]],
+    language: str = "ko",
+    model: str = OLLAMA_MODEL
+) -> Tuple[str, Dict[str, int]]:
+    """RAG prompt whose context fits the model's context window, plus packing stats.
+
+    The instructions go separately as rag_system_prompt() so every request
+    starts with the same tokens and Ollama can reuse its cached prefix; the
+    question comes last, after the context. Token counts use the embedding
+    model's tokenizer as an approximation of the LLM's; LLM_ANSWER_TOKENS of
+    the window are left for the answer.
+    """
+    def render(context_text: str) -> str:
+        return f"""Context:
+{context_text}
 
 Question: {question}
 
-Context:
-{sources_text}
-
 Answer in {language}:"""
 
+    window = model_context_window(model)
+    budget = max(0, window - LLM_ANSWER_TOKENS - sum(count_tokens([rag_system_prompt(language), render("")])))
+    passages, stats = pack_contexts(contexts, budget)
+
+    blocks = []
+    for i, p in enumerate(passages, start=1):
+        label = p["filename"]
+        if p["page_start"] is not None:
+            pages = p["page_start"] if p["page_start"] == p["page_end"] else f"{p['page_start']}-{p['page_end']}"
+            label += f" (p.{pages})"
+        blocks.append(f"[{i}] {label}\n{p['text']}")
+
+    # 이전 방식(청크마다 1500자씩 그대로 나열) 대비 절약한 토큰
+    naive = [(c.get("payload") or {}).get("text", "")[:1500] for c in contexts]
+    stats["naive_tokens"] = sum(count_tokens(naive)) if naive else 0
+    stats["saved_tokens"] = max(0, stats["naive_tokens"] - stats["context_tokens"])
+    return render("\n\n".join(blocks)), stats
+
+# ==================== 문서 추출 및 청킹 ====================
+def iter_pdf_pages(fp: Path, first: int = 1, last: Optional[int] = None) -> Iterable[Tuple[int, str]]:
+    """Yield (page number, text) one page at a time, pages numbered from 1"""
+    try:
+        import fitz
+        doc = fitz.open(str(fp))
+    except Exception as e1:
+        log.warning(f"PyMuPDF failed for {fp.name}: {e1}, trying pypdf")
+        from pypdf import PdfReader
+        reader = PdfReader(str(fp))
+        end = min(last or len(reader.pages), len(reader.pages))
+        for no in range(first, end + 1):
+            yield no, reader.pages[no - 1].extract_text() or ""
+        return
+    try:
+        end = min(last or doc.page_count, doc.page_count)
+        for no in range(first, end + 1):
+            try:
+                yield no, doc.load_page(no - 1).get_text("text")
+            except Exception as e:
+                log.warning(f"Failed to read page {no} of {fp.name}: {e}")
+                yield no, ""
+    finally:
+        doc.close()
+
+def iter_document_segments(fp: Path) -> Iterable[Tuple[str, Dict[str, Any]]]:
+    """Yield a document as (text, meta) segments; PDFs stream page by page"""
+    if fp.suffix.lower() == ".pdf":
+        log.info(f"Reading file: {fp.name} (type: .pdf, page-streaming)")
+        pages = 0
+        for no, text in iter_pdf_pages(fp):
+            pages += 1
+            yield text, {"page": no}
+        log.info(f"Successfully read PDF {fp.name} ({pages} pages)")
+        return
+    text = read_file_text(fp)
+    if text:
+        yield text, {}
+
+def chunk_segments(
+    segments: Iterable[Tuple[str, Dict[str, Any]]],
+    chunk_size: int = CHUNK_SIZE,
+    overlap: int = CHUNK_OVERLAP
+) -> Iterable[Dict[str, Any]]:
+    """Incremental version of chunk_text over a stream of segments.
+
+    Segments are treated as if joined with "\\n", producing the same chunks
+    chunk_text would on the joined text, but only about one chunk plus one
+    segment is held in memory. Each chunk carries its character offsets in
+    the joined text and, when segments are pages, its page range.
+    """
+    buf = ""        # 아직 청크로 내보내지 않은 텍스트 (전역 오프셋 buf_start부터)
+    buf_start = 0
+    marks: List[Tuple[int, Any]] = []  # (세그먼트 시작 오프셋, 페이지)
+    total = 0
+    start = 0
+
+    def page_at(offset: int):
+        page = None
+        for mark_offset, mark_page in marks:
+            if mark_offset > offset:
+                break
+            page = mark_page
+        return page
+
+    def make_chunk(a: int, b: int) -> Optional[Dict[str, Any]]:
+        piece = buf[a - buf_start:b - buf_start]
+        stripped = piece.strip()
+        if not stripped:
+            return None
+        a += len(piece) - len(piece.lstrip())
+        b = a + len(stripped)
+        rec = {"text": stripped, "start": a, "end": b}
+        if marks and marks[0][1] is not None:
+            rec["page_start"] = page_at(a)
+            rec["page_end"] = page_at(b - 1)
+        return rec
+
+    for i, (text, meta) in enumerate(segments):
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if i:
+            text = "\n" + text
+        marks.append((total + (1 if i else 0), meta.get("page")))
+        buf += text
+        total += len(text)
+        if chunk_size <= 0:
+            continue
+        # 뒤에 텍스트가 더 있는 것이 확실한 청크만 먼저 내보냄
+        while start + chunk_size < total:
+            end = start + chunk_size
+            rec = make_chunk(start, end)
+            if rec:
+                yield rec
+            start = end - overlap if overlap < chunk_size else end
+            buf = buf[start - buf_start:]
+            buf_start = start
+            while len(marks) > 1 and marks[1][0] <= start:
+                marks.pop(0)
+
+    while start < total:
+        end = total if chunk_size <= 0 else min(start + chunk_size, total)
+        rec = make_chunk(start, end)
+        if rec:
+            yield rec
+        if end == total:
+            break
+        start = end - overlap if overlap < chunk_size else end
+
+# 문장 경계: 종결 부호(+닫는 따옴표/괄호) 뒤 공백, 또는 줄바꿈
+_SENTENCE_END = re.compile(r'[.!?。！？…]+["\'”’)\]]*(?=\s)|\n')
+_TOKEN_ESTIMATE = re.compile(r"[가-힣]{1,2}|[A-Za-z]{1,4}|\d{1,3}|[^\sA-Za-z\d가-힣]")
+
+def load_chunk_tokenizer(tokenizer_json: str):
+    from tokenizers import Tokenizer
+    tok = Tokenizer.from_str(tokenizer_json)
+    tok.no_truncation()
+    tok.no_padding()
+    return tok
+
+def get_chunk_tokenizer():
+    """Embedding-model tokenizer used to size chunks, or None before the model is loaded"""
+    global _chunk_tokenizer
+    if _chunk_tokenizer is None and _embedding_model is not None:
+        tok = getattr(getattr(_embedding_model, "model", None), "tokenizer", None)
+        if tok is not None:
+            _chunk_tokenizer = load_chunk_tokenizer(tok.to_str())
+    return _chunk_tokenizer
+
+def init_parse_worker(tokenizer_json: Optional[str]):
+    """Parser pool initializer: workers have no embedding model, only its tokenizer"""
+    global _chunk_tokenizer
+    if tokenizer_json:
+        _chunk_tokenizer = load_chunk_tokenizer(tokenizer_json)
+
+def count_tokens(texts: List[str]) -> List[int]:
+    tok = get_chunk_tokenizer()
+    if tok is None:
+        # 토크나이저가 없으면 한글 2자, 영문 4자 정도를 한 토큰으로 추정
+        return [len(_TOKEN_ESTIMATE.findall(t)) for t in texts]
+    return [len(e.ids) for e in tok.encode_batch(texts, add_special_tokens=False)]
+
+def split_sentences(text: str) -> List[Tuple[int, int, int]]:
+    """Split text into stripped (start, end, boundary) spans.
+
+    boundary is 2 after a paragraph (blank line), 1 after sentence-ending
+    punctuation and 0 after a plain line break.
+    """
+    spans = []
+    pos = 0
+    for m in _SENTENCE_END.finditer(text):
+        spans.append((pos, m.end()))
+        pos = m.end()
+    spans.append((pos, len(text)))
+
+    result: List[List[int]] = []
+    for a, b in spans:
+        piece = text[a:b]
+        stripped = piece.strip()
+        if not stripped:
+            if result and piece.count("\n") + text[a - 1:a].count("\n") >= 1:
+                result[-1][2] = 2
+            continue
+        a += len(piece) - len(piece.lstrip())
+        b = a + len(stripped)
+        boundary = 1 if re.search(r'[.!?。！？…]["\'”’)\]]*$', stripped) else 0
+        result.append([a, b, boundary])
+    return [tuple(r) for r in result]
+
+def split_long_span(text: str, a: int, b: int, limit: int) -> List[Tuple[int, int, int]]:
+    """Cut a span longer than limit tokens into (start, end, tokens) pieces"""
+    tok = get_chunk_tokenizer()
+    if tok is not None:
+        offsets = tok.encode(text[a:b], add_special_tokens=False).offsets
+        pieces = []
+        for i in range(0, len(offsets), limit):
+            group = offsets[i:i + limit]
+            start = a + (0 if i == 0 else group[0][0])
+            end = b if i + limit >= len(offsets) else a + offsets[i + limit][0]
+            pieces.append((start, end, len(group)))
+        return pieces
+    total = count_tokens([text[a:b]])[0]
+    step = max(1, (b - a) * limit // max(total, 1))
+    return [(s, min(s + step, b), limit) for s in range(a, b, step)]
+
+def chunk_segments_by_sentence(
+    segments: Iterable[Tuple[str, Dict[str, Any]]],
+    max_tokens: int = CHUNK_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS
+) -> Iterable[Dict[str, Any]]:
+    """Pack whole sentences into chunks of at most max_tokens embedding-model tokens.
+
+    Chunks end at a paragraph or sentence boundary when one falls in the
+    second half of the budget, and the next chunk repeats up to
+    overlap_tokens of trailing sentences (never across a paragraph break,
+    and only as many as fit beside the next sentence, so every chunk
+    contains new text).
+    Records have the same shape as chunk_segments, including offsets into
+    the segments joined with "\\n" and page ranges.
+    """
+    buf = ""
+    buf_start = 0
+    total = 0
+    pending: List[Dict[str, Any]] = []
+
+    def make_chunk(units: List[Dict[str, Any]]) -> Dict[str, Any]:
+        a, b = units[0]["start"], units[-1]["end"]
+        rec = {"text": buf[a - buf_start:b - buf_start], "start": a, "end": b}
+        if units[0]["page"] is not None:
+            rec["page_start"] = units[0]["page"]
+            rec["page_end"] = units[-1]["page"]
+        return rec
+
+    carried = 0  # pending 앞쪽에 겹침으로 남겨둔 단위 수
+
+    def flush(final: bool):
+        nonlocal pending, buf, buf_start, carried
+        while pending and (final or sum(u["tokens"] for u in pending) > max_tokens):
+            used = 0
+            take = 0
+            for u in pending:
+                if take and used + u["tokens"] > max_tokens:
+                    break
+                used += u["tokens"]
+                take += 1
+            if take < len(pending):
+                # 예산의 절반 이상을 채운 지점 중 문단 > 문장 경계 순으로 자르기 좋은 곳 선택
+                best, best_rank, acc = take, -1, 0
+                for i, u in enumerate(pending[:take], start=1):
+                    acc += u["tokens"]
+                    # 겹침 문장 안에서는 자르지 않음 (새 문장이 하나도 없는 청크 방지)
+                    if i > carried and acc * 2 >= max_tokens and u["boundary"] >= best_rank and u["boundary"] > 0:
+                        best, best_rank = i, u["boundary"]
+                take = best
+            yield make_chunk(pending[:take])
+
+            carry = take
+            # 남은 문장이 없으면(마지막 청크) 겹침을 남기지 않음
+            if take < len(pending) and pending[take - 1]["boundary"] < 2:
+                # 다음 단위와 함께 예산 안에 들어가는 만큼만 겹침으로 남겨 다음 청크가 항상 앞으로 나아가게 함
+                room = min(overlap_tokens, max_tokens - pending[take]["tokens"])
+                acc = 0
+                while carry > 1 and acc + pending[carry - 1]["tokens"] <= room:
+                    acc += pending[carry - 1]["tokens"]
+                    carry -= 1
+            carried = take - carry
+            pending = pending[carry:]
+            if pending:
+                buf = buf[pending[0]["start"] - buf_start:]
+                buf_start = pending[0]["start"]
+
+    for i, (text, meta) in enumerate(segments):
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if i:
+            text = "\n" + text
+        base = total
+        if not pending:
+            buf, buf_start = "", base
+        buf += text
+        total += len(text)
+        spans = split_sentences(text)
+        counts = count_tokens([text[a:b] for a, b, _ in spans])
+        for (a, b, boundary), n in zip(spans, counts):
+            pieces = [(a, b, n)] if n <= max_tokens else split_long_span(text, a, b, max_tokens)
+            for j, (pa, pb, pn) in enumerate(pieces):
+                pending.append({
+                    "start": base + pa,
+                    "end": base + pb,
+                    "tokens": pn,
+                    "page": meta.get("page"),
+                    "boundary": boundary if j == len(pieces) - 1 else 0,
+                })
+        yield from flush(final=False)
+    yield from flush(final=True)
+
+CHUNKERS = {
+    "fixed": chunk_segments,                # 기존 고정 길이 문자 슬라이딩 윈도우
+    "sentence": chunk_segments_by_sentence,  # 토큰 예산 + 문장/문단 경계
+}
+
+def get_chunker(name: Optional[str] = None):
+    name = name or CHUNKER
+    if name not in CHUNKERS:
+        log.warning(f"Unknown chunker '{name}', using 'sentence'")
+        name = "sentence"
+    return CHUNKERS[name]
+
+def compare_chunkers(files: List[Path], sample_size: int = 64) -> Dict[str, Any]:
+    """Chunk the same files with every chunker and estimate embedding cost of each.
+
+    Embedding time is estimated from tokens embedded, using a throughput
+    measured on a sample of the chunks with the loaded model.
+    """
+    report: Dict[str, Any] = {}
+    samples: List[str] = []
+    for name, chunker in CHUNKERS.items():
+        chunks = 0
+        tokens = 0
+        t0 = time.perf_counter()
+        for fp in files:
+            texts = [rec["text"] for rec in chunker(iter_document_segments(fp))]
+            chunks += len(texts)
+            tokens += sum(count_tokens(texts))
+            samples.extend(texts[:max(0, sample_size - len(samples))])
+        report[name] = {
+            "chunks": chunks,
+            "tokens": tokens,
+            "chunking_seconds": round(time.perf_counter() - t0, 3),
+        }
+
+    sec_per_token = None
+    if samples and _embedding_model is not None:
+        t0 = time.perf_counter()
+        list(_embedding_model.embed(samples, batch_size=FASTEMBED_BATCH))
+        sec_per_token = (time.perf_counter() - t0) / max(1, sum(count_tokens(samples)))
+    for stats in report.values():
+        stats["est_embedding_seconds"] = round(stats["tokens"] * sec_per_token, 2) if sec_per_token else None
+
+    base, new = report["fixed"], report[CHUNKER if CHUNKER in report else "sentence"]
+    report["savings"] = {
+        "chunker": CHUNKER,
+        "chunks_pct": round(100 * (1 - new["chunks"] / base["chunks"]), 1) if base["chunks"] else 0.0,
+        "tokens_pct": round(100 * (1 - new["tokens"] / base["tokens"]), 1) if base["tokens"] else 0.0,
+    }
+    if sec_per_token:
+        report["savings"]["est_ingest_seconds_saved"] = round(
+            base["est_embedding_seconds"] - new["est_embedding_seconds"], 2
+        )
+    report["files"] = len(files)
+    return report
+
+def detect_text_encoding(fp: Path) -> Tuple[str, str]:
+    """Pick the first of utf-8/cp949/euc-kr that decodes the whole file, reading it in blocks"""
+    import codecs
+    for enc in ("utf-8", "cp949", "euc-kr"):
+        decoder = codecs.getincrementaldecoder(enc)()
+        try:
+            with open(fp, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    decoder.decode(block)
+            decoder.decode(b"", final=True)
+            return enc, "strict"
+        except UnicodeDecodeError:
+            continue
+    return "utf-8", "ignore"
+
+def iter_table_rows(
+    fp: Path,
+    sink: Optional[Callable[[str], Any]] = None
+) -> Iterable[Tuple[Optional[str], Iterable[Tuple[int, str, int]]]]:
+    """Yield (sheet name, rows) per sheet; rows yields (row number, line, offset) for non-empty rows.
+
+    Lines are tab-joined cells and offsets refer to the text read_file_text
+    builds for the same file, so the two stay interchangeable. If given, sink
+    receives that text piece by piece as rows are read.
+    """
+    pos = 0
+
+    def emit(line: str):
+        nonlocal pos
+        if sink is not None:
+            sink(("\n" if pos else "") + line)
+        pos += len(line) + 1
+
+    def csv_rows(reader):
+        for row_no, row in enumerate(reader, start=1):
+            line = "\t".join("" if c is None else str(c) for c in row)
+            if line.strip():
+                yield row_no, line, pos
+            emit(line)
+
+    def sheet_rows(ws, title_line: str):
+        emit(title_line)
+        for row_no, row in enumerate(ws.iter_rows(values_only=True), start=1):
+            line = "\t".join("" if c is None else str(c) for c in row)
+            if not line.strip():  # 빈 행 제외
+                continue
+            yield row_no, line, pos
+            emit(line)
+
+    if fp.suffix.lower() == ".csv":
+        import csv
+        enc, errors = detect_text_encoding(fp)
+        with open(fp, encoding=enc, errors=errors, newline="") as f:
+            yield None, csv_rows(csv.reader(f))
+        return
+
+    from openpyxl import load_workbook
+    wb = load_workbook(filename=str(fp), read_only=True, data_only=True)
+    try:
+        for ws in wb.worksheets:
+            yield ws.title, sheet_rows(ws, f"# Sheet: {ws.title}")
+    finally:
+        wb.close()
+
+def iter_table_chunks(
+    fp: Path,
+    rows_per_chunk: int = TABLE_CHUNK_ROWS,
+    max_chars: int = TABLE_CHUNK_CHARS,
+    sink: Optional[Callable[[str], Any]] = None
+) -> Iterable[Dict[str, Any]]:
+    """Yield chunks of complete rows from a CSV or XLSX file in constant memory.
+
+    The first non-empty row of each sheet is treated as its header and is
+    repeated, with the sheet name, at the top of every chunk of that sheet.
+    """
+    log.info(f"Reading file: {fp.name} (type: {fp.suffix.lower()}, row-streaming)")
+    total_rows = 0
+    total_chunks = 0
+
+    def make_chunk(prefix: str, sheet: Optional[str], batch: List[Tuple[int, str, int]]) -> Dict[str, Any]:
+        rec = {
+            "text": prefix + "\n" + "\n".join(line for _, line, _ in batch),
+            "start": batch[0][2],
+            "end": batch[-1][2] + len(batch[-1][1]),
+            "row_start": batch[0][0],
+            "row_end": batch[-1][0],
+        }
+        if sheet is not None:
+            rec["sheet"] = sheet
+        return rec
+
+    for sheet, rows in iter_table_rows(fp, sink):
+        prefix = None
+        header_row = None
+        batch: List[Tuple[int, str, int]] = []
+        size = 0
+        for row in rows:
+            if prefix is None:
+                header_row = row
+                prefix = (f"# Sheet: {sheet}\n" if sheet is not None else "") + row[1]
+                continue
+            if batch and (len(batch) >= rows_per_chunk or size + len(row[1]) > max_chars):
+                yield make_chunk(prefix, sheet, batch)
+                total_chunks += 1
+                batch, size = [], 0
+            batch.append(row)
+            size += len(row[1]) + 1
+            total_rows += 1
+        if batch:
+            yield make_chunk(prefix, sheet, batch)
+            total_chunks += 1
+        elif header_row is not None:
+            # 헤더만 있는 시트도 검색되도록 헤더 자체를 청크로 사용
+            yield make_chunk(f"# Sheet: {sheet}" if sheet is not None else "", sheet, [header_row])
+            total_chunks += 1
+    log.info(f"Successfully read {fp.name} ({total_rows} rows, {total_chunks} chunks)")
+
+def tee_segments(
+    segments: Iterable[Tuple[str, Dict[str, Any]]],
+    sink: Callable[[str], Any],
+    pages: List[int]
+) -> Iterable[Tuple[str, Dict[str, Any]]]:
+    """Pass segments through unchanged while writing the text the chunkers index into.
+
+    That is the segments with normalized line endings joined with "\n", so
+    chunk offsets point straight into it; pages collects where each page starts.
+    """
+    total = 0
+    for i, (text, meta) in enumerate(segments):
+        normalized = text.replace("\r\n", "\n").replace("\r", "\n")
+        if i:
+            sink("\n")
+            total += 1
+        if meta.get("page") is not None:
+            pages.append(total)
+        sink(normalized)
+        total += len(normalized)
+        yield text, meta
+
+def extract_to_spool(fp: Path, spool: Path, text_path: Optional[Path] = None) -> Dict[str, Any]:
+    """Extract and chunk a document, writing chunk records to a JSONL spool file.
+
+    Runs inside the parser pool; the spool keeps the result on disk so neither
+    the worker nor the server process ever holds a whole document. With
+    text_path, the extracted text the chunk offsets refer to is streamed there
+    gzip-compressed, and the start offset of each PDF page is returned.
+    """
+    chunks = 0
+    chars = 0
+    pages: List[int] = []
+    text_out = gzip.open(text_path, "wt", encoding="utf-8", newline="") if text_path else None
+    try:
+        sink = text_out.write if text_out else None
+        if fp.suffix.lower() in {".csv", ".xlsx"}:
+            records = iter_table_chunks(fp, sink=sink)
+        else:
+            segments = iter_document_segments(fp)
+            if sink:
+                segments = tee_segments(segments, sink, pages)
+            records = get_chunker()(segments)
+        with open(spool, "w", encoding="utf-8") as f:
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                chunks += 1
+                chars = rec["end"]
+    finally:
+        if text_out:
+            text_out.close()
+    return {"chunks": chunks, "chars": chars, "pages": pages}
+
+def read_spool_records(f, limit: int) -> List[Dict[str, Any]]:
+    records = []
+    for line in f:
+        records.append(json.loads(line))
+        if len(records) >= limit:
+            break
+    return records
+
+# ==================== 문서 파싱 프로세스 풀 ====================
+def get_parse_pool() -> Optional[ProcessPoolExecutor]:
+    global _parse_pool
+    if PARSE_WORKERS <= 0:
+        return None
+    if _parse_pool is None:
+        # ONNX/Qdrant 스레드가 있는 프로세스를 fork하지 않도록 spawn 사용
+        tok = get_chunk_tokenizer()
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=PARSE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=PARSE_MAX_TASKS_PER_CHILD or None,
+            initializer=init_parse_worker,
+            initargs=(tok.to_str() if tok is not None else None,),
+        )
+        log.info(f"Started parser pool ({PARSE_WORKERS} workers)")
+    return _parse_pool
+
+def reset_parse_pool(pool: Optional[ProcessPoolExecutor], kill: bool = False):
+    """Discard a parser pool; the next get_parse_pool() call starts a fresh one"""
+    global _parse_pool
+    if pool is None:
+        return
+    if _parse_pool is pool:
+        _parse_pool = None
+    if kill:
+        # 멈춘 워커는 shutdown()으로 끝나지 않으므로 직접 종료
+        for proc in list((pool._processes or {}).values()):
+            proc.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def parse_file(
+    fp: Path,
+    retries: int = 1,
+    text_path: Optional[Path] = None
+) -> Optional[Tuple[Path, Dict[str, Any]]]:
+    """Extract and chunk a file in the parser pool with a per-file timeout and crash isolation.
+
+    Returns the JSONL spool of chunk records with the extraction stats, or
+    None if the file could not be parsed. text_path is passed to extract_to_spool.
+    """
+    spool = SPOOL_DIR / f"{uuid.uuid4().hex}.jsonl"
+    for attempt in range(retries + 1):
+        pool = get_parse_pool()
+        try:
+            if pool is None:
+                info = await asyncio.wait_for(
+                    asyncio.to_thread(extract_to_spool, fp, spool, text_path), timeout=PARSE_TIMEOUT
+                )
+            else:
+                loop = asyncio.get_running_loop()
+                info = await asyncio.wait_for(
+                    loop.run_in_executor(pool, extract_to_spool, fp, spool, text_path),
+                    timeout=PARSE_TIMEOUT
+                )
+            return spool, info
+        except asyncio.TimeoutError:
+            if pool is None:
+                log.error(f"Parsing timed out after {PARSE_TIMEOUT}s: {fp.name}")
+            else:
+                log.error(f"Parsing timed out after {PARSE_TIMEOUT}s, restarting parser pool: {fp.name}")
+                reset_parse_pool(pool, kill=True)
+            break
+        except BrokenProcessPool:
+            # 같은 풀에서 처리 중이던 다른 파일도 함께 실패하므로 새 풀에서 한 번 더 시도
+            reset_parse_pool(pool)
+            if attempt < retries:
+                log.warning(f"Parser worker died while reading {fp.name}, retrying")
+                continue
+            log.error(f"Parser worker crashed on {fp.name}, skipping file")
+        except Exception as e:
+            log.error(f"Error reading file {fp.name}: {e}")
+            break
+        except asyncio.CancelledError:
+            spool.unlink(missing_ok=True)
+            if text_path is not None:
+                text_path.unlink(missing_ok=True)
+            raise
+    spool.unlink(missing_ok=True)
+    if text_path is not None:
+        text_path.unlink(missing_ok=True)
+    return None
+
+# ==================== 임베딩 캐시 ====================
+def get_embed_cache_db() -> sqlite3.Connection:
+    """Content-addressed vector cache keyed by (model, sha256(text)); callers hold _embed_cache_lock"""
+    global _embed_cache_db
+    if _embed_cache_db is None:
+        conn = sqlite3.connect(str(EMBED_CACHE_DB_PATH), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_lru ON embedding_cache (last_used)")
+        row = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embedding_cache").fetchone()
+        _embed_cache_stats["bytes"] = row[0]
+        _embed_cache_db = conn
+    return _embed_cache_db
+
+def embedding_cache_get(keys: List[str]) -> Dict[str, np.ndarray]:
+    found: Dict[str, np.ndarray] = {}
+    unique = list(dict.fromkeys(keys))
+    with _embed_cache_lock:
+        db = get_embed_cache_db()
+        for i in range(0, len(unique), 500):
+            part = unique[i:i + 500]
+            rows = db.execute(
+                f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? "
+                f"AND text_hash IN ({','.join('?' * len(part))})",
+                (EMBEDDING_MODEL, *part)
+            ).fetchall()
+            for text_hash, blob in rows:
+                found[text_hash] = np.frombuffer(blob, dtype=np.float32)
+        if found:
+            now = time.time()
+            with db:
+                db.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, EMBEDDING_MODEL, k) for k in found]
+                )
+        _embed_cache_stats["hits"] += sum(1 for k in keys if k in found)
+        _embed_cache_stats["misses"] += sum(1 for k in keys if k not in found)
+    return found
+
+def embedding_cache_put(vectors: Dict[str, np.ndarray]):
+    now = time.time()
+    rows = [(EMBEDDING_MODEL, k, np.asarray(v, dtype=np.float32).tobytes(), now) for k, v in vectors.items()]
+    with _embed_cache_lock:
+        db = get_embed_cache_db()
+        with db:
+            db.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)",
+                rows
+            )
+        _embed_cache_stats["bytes"] += sum(len(r[2]) for r in rows)
+        limit = EMBED_CACHE_MAX_MB * 1024 * 1024
+        if _embed_cache_stats["bytes"] > limit:
+            _evict_embedding_cache(db, int(limit * 0.9))
+
+def _evict_embedding_cache(db: sqlite3.Connection, target_bytes: int):
+    """Drop least recently used vectors until the cache fits in target_bytes"""
+    evicted = 0
+    while _embed_cache_stats["bytes"] > target_bytes:
+        rows = db.execute(
+            "SELECT rowid, LENGTH(vector) FROM embedding_cache ORDER BY last_used LIMIT 1000"
+        ).fetchall()
+        if not rows:
+            break
+        victims = []
+        for rowid, nbytes in rows:
+            victims.append((rowid,))
+            _embed_cache_stats["bytes"] -= nbytes
+            if _embed_cache_stats["bytes"] <= target_bytes:
+                break
+        with db:
+            db.executemany("DELETE FROM embedding_cache WHERE rowid = ?", victims)
+        evicted += len(victims)
+    _embed_cache_stats["evictions"] += evicted
+    log.info(f"Embedding cache evicted {evicted} vectors ({_embed_cache_stats['bytes']} bytes kept)")
+
+def normalize_query(question: str) -> str:
+    """Canonical form of a question: NFKC with collapsed whitespace"""
+    return " ".join(unicodedata.normalize("NFKC", question).split())
+
+def query_cache_lookup(key: str) -> Optional[np.ndarray]:
+    """Vector for a normalized question if it was embedded within QUERY_CACHE_TTL"""
+    if QUERY_CACHE_SIZE <= 0:
+        return None
+    with _query_cache_lock:
+        item = _query_cache.get(key)
+        if item is not None:
+            if QUERY_CACHE_TTL <= 0 or time.monotonic() - item[0] < QUERY_CACHE_TTL:
+                _query_cache.move_to_end(key)
+                _query_cache_stats["hits"] += 1
+                return item[1]
+            del _query_cache[key]
+            _query_cache_stats["expired"] += 1
+        _query_cache_stats["misses"] += 1
+    return None
+
+def query_cache_store(key: str, vec: np.ndarray):
+    if QUERY_CACHE_SIZE <= 0:
+        return
+    with _query_cache_lock:
+        _query_cache[key] = (time.monotonic(), vec)
+        _query_cache.move_to_end(key)
+        while len(_query_cache) > QUERY_CACHE_SIZE:
+            _query_cache.popitem(last=False)
+            _query_cache_stats["evictions"] += 1
+
+def query_cache_stats() -> Dict[str, Any]:
+    with _query_cache_lock:
+        lookups = _query_cache_stats["hits"] + _query_cache_stats["misses"]
+        return {
+            "enabled": QUERY_CACHE_SIZE > 0,
+            "entries": len(_query_cache),
+            "max_entries": QUERY_CACHE_SIZE,
+            "ttl_seconds": QUERY_CACHE_TTL,
+            **_query_cache_stats,
+            "hit_rate": round(_query_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+def embedding_cache_stats() -> Dict[str, Any]:
+    lookups = _embed_cache_stats["hits"] + _embed_cache_stats["misses"]
+    return {
+        "enabled": EMBED_CACHE_MAX_MB > 0,
+        "model": EMBEDDING_MODEL,
+        "max_mb": EMBED_CACHE_MAX_MB,
+        "size_mb": round(_embed_cache_stats["bytes"] / (1024 * 1024), 2),
+        "hits": _embed_cache_stats["hits"],
+        "misses": _embed_cache_stats["misses"],
+        "evictions": _embed_cache_stats["evictions"],
+        "hit_rate": round(_embed_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+    }
+
+# ==================== 답변 캐시 ====================
+def bump_index_version(reason: str):
+    """Advance the collection version after its contents change; cached answers become stale"""
+    global _index_version
+    with _answer_cache_lock:
+        _index_version += 1
+        dropped = len(_answer_cache)
+        _answer_cache.clear()
+    if dropped:
+        log.info(f"Index version {_index_version} ({reason}): dropped {dropped} cached answers")
+
+def answer_cache_key(req: "QueryRequest", model: str, version: int) -> Tuple:
+    sources = tuple(sorted(set(req.selected_sources or [])))
+    return (normalize_query(req.question), sources, model, req.language, req.top_k, version)
+
+def answer_cache_get(
+    req: "QueryRequest",
+    model: str,
+    version: int,
+    qvec: Optional[np.ndarray] = None
+) -> Optional[Dict[str, Any]]:
+    """Cached {"sources", "tokens"} for a RAG question.
+
+    Without qvec the question must match exactly; callers then embed the
+    question and look again with qvec to match by similarity.
+    """
+    if ANSWER_CACHE_SIZE <= 0 or (qvec is not None and ANSWER_CACHE_SIMILARITY <= 0):
+        return None
+    key = answer_cache_key(req, model, version)
+    now = time.monotonic()
+    with _answer_cache_lock:
+        entry = None
+        if qvec is None:
+            entry = _answer_cache.get(key)
+        else:
+            # 같은 조건(문서 선택/모델/언어/top_k/버전)으로 캐시된 질문 중 가장 가까운 것
+            q = qvec / (np.linalg.norm(qvec) or 1.0)
+            best = ANSWER_CACHE_SIMILARITY
+            for k, e in _answer_cache.items():
+                if k[1:] != key[1:]:
+                    continue
+                sim = float(np.dot(q, e["qvec"]))
+                if sim >= best:
+                    key, entry, best = k, e, sim
+        if entry is not None and ANSWER_CACHE_TTL > 0 and now - entry["created"] >= ANSWER_CACHE_TTL:
+            del _answer_cache[key]
+            entry = None
+        if entry is None:
+            # 유사도 조회가 뒤따르면 그쪽에서 한 번만 미스로 집계
+            if qvec is not None or ANSWER_CACHE_SIMILARITY <= 0:
+                _answer_cache_stats["misses"] += 1
+            return None
+        _answer_cache.move_to_end(key)
+        _answer_cache_stats["semantic_hits" if qvec is not None else "hits"] += 1
+        return entry
+
+def answer_cache_put(
+    req: "QueryRequest",
+    model: str,
+    version: int,
+    qvec: np.ndarray,
+    sources: List[Dict[str, Any]],
+    tokens: List[str]
+):
+    if ANSWER_CACHE_SIZE <= 0 or not tokens:
+        return
+    with _answer_cache_lock:
+        # 생성 도중 색인이 바뀌었으면 저장하지 않음
+        if version != _index_version:
+            return
+        _answer_cache[answer_cache_key(req, model, version)] = {
+            "created": time.monotonic(),
+            "qvec": qvec / (np.linalg.norm(qvec) or 1.0),
+            "sources": sources,
+            "tokens": tokens,
+        }
+        while len(_answer_cache) > ANSWER_CACHE_SIZE:
+            _answer_cache.popitem(last=False)
+            _answer_cache_stats["evictions"] += 1
+
+def answer_cache_stats() -> Dict[str, Any]:
+    with _answer_cache_lock:
+        hits = _answer_cache_stats["hits"] + _answer_cache_stats["semantic_hits"]
+        lookups = hits + _answer_cache_stats["misses"]
+        return {
+            "enabled": ANSWER_CACHE_SIZE > 0,
+            "entries": len(_answer_cache),
+            "max_entries": ANSWER_CACHE_SIZE,
+            "ttl_seconds": ANSWER_CACHE_TTL,
+            "similarity_threshold": ANSWER_CACHE_SIMILARITY,
+            "index_version": _index_version,
+            **_answer_cache_stats,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+# ==================== 질문 임베딩 배치 ====================
+class Histogram:
+    """Fixed-bucket histogram; each bucket counts observations <= its bound"""
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {f"<={b}": c for b, c in zip(self.bounds, self.counts)}
+        buckets["+Inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 3) if self.count else 0.0,
+            "buckets": buckets,
+        }
+
+class QueryEmbedBatcher:
+    """Coalesces questions from concurrent requests into one embedding call.
+
+    A batch closes after QUERY_BATCH_WAIT_MS from its first question or at
+    QUERY_BATCH_MAX questions. At most EMBED_CONCURRENCY batches run at once;
+    while they run, new questions keep queueing, so batches grow with load.
+    """
+
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(max(1, EMBED_CONCURRENCY))
+        self.task: Optional[asyncio.Task] = None
+        self.dispatching: set = set()  # 이벤트 루프는 태스크를 약하게 참조하므로 실행 중인 배치를 여기서 붙잡아 둠
+        self.batch_sizes = Histogram((1, 2, 4, 8, 16, 32, 64, 128))
+        self.wait_ms = Histogram((1, 2, 5, 10, 20, 50, 100, 250, 500, 1000))
+
+    async def embed(self, text: str) -> np.ndarray:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, fut, time.perf_counter()))
+        return await fut
+
+    async def run(self):
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = time.perf_counter() + QUERY_BATCH_WAIT_MS / 1000
+            while len(batch) < QUERY_BATCH_MAX:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.create_task(self.dispatch(batch))
+            self.dispatching.add(task)
+            task.add_done_callback(self.dispatching.discard)
+
+    async def dispatch(self, batch: List[Tuple[str, asyncio.Future, float]]):
+        try:
+            now = time.perf_counter()
+            for _, _, queued in batch:
+                self.wait_ms.observe((now - queued) * 1000)
+            self.batch_sizes.observe(len(batch))
+            # 같은 질문이 한 배치에 여러 번 들어오면 한 번만 임베딩
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                vectors = await run_embedding(embed_texts_batch, texts, use_cache=False)
+            except Exception as e:
+                for _, fut, _ in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                return
+            by_text = dict(zip(texts, vectors))
+            for text, fut, _ in batch:
+                if not fut.done():
+                    fut.set_result(by_text[text])
+        finally:
+            self.slots.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch": QUERY_BATCH_MAX,
+            "wait_ms": QUERY_BATCH_WAIT_MS,
+            "queued": self.queue.qsize(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.wait_ms.snapshot(),
+        }
+
+def get_query_batcher() -> QueryEmbedBatcher:
+    global _query_batcher
+    if _query_batcher is None:
+        _query_batcher = QueryEmbedBatcher()
+    return _query_batcher
+
+async def embed_query(question: str) -> np.ndarray:
+    """Embed a search question via the LRU, or else the shared micro-batcher"""
+    key = normalize_query(question)
+    vec = query_cache_lookup(key)
+    if vec is None:
+        vec = await get_query_batcher().embed(key)
+        query_cache_store(key, vec)
+    return vec
+
+# ==================== LLM 스케줄러 ====================
+LLM_PRIORITIES = {"interactive": 0, "batch": 1}
+
+class LLMTicket:
+    """One caller's place in a model's generation queue"""
+
+    def __init__(self, model: str, priority: str, seq: int):
+        self.model = model
+        self.rank = (LLM_PRIORITIES.get(priority, 0), seq)
+        self.granted = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+class LLMScheduler:
+    """Admission control in front of Ollama.
+
+    Each model runs at most its concurrency limit of generations; further
+    callers wait in a bounded queue ordered by priority, then arrival.
+    A full queue rejects immediately with 429, a wait longer than
+    LLM_QUEUE_TIMEOUT fails with 503.
+    """
+
+    def __init__(self):
+        self.gates: Dict[str, Dict[str, Any]] = {}
+        self.seq = 0
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    def gate(self, model: str) -> Dict[str, Any]:
+        if model not in self.gates:
+            self.gates[model] = {
+                "limit": max(1, LLM_MODEL_CONCURRENCY.get(model, LLM_CONCURRENCY)),
+                "active": 0,
+                "waiting": [],
+                "moved": asyncio.Event(),
+            }
+        return self.gates[model]
+
+    def check_capacity(self, model: str):
+        gate = self.gate(model)
+        if gate["active"] >= gate["limit"] and len(gate["waiting"]) >= LLM_QUEUE_MAX:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many requests waiting for model '{model}'. Please retry shortly.",
+                headers={"Retry-After": "5"}
+            )
+
+    def admit(self, model: str, priority: str = "interactive") -> LLMTicket:
+        self.check_capacity(model)
+        gate = self.gate(model)
+        self.seq += 1
+        ticket = LLMTicket(model, priority, self.seq)
+        if gate["active"] < gate["limit"] and not gate["waiting"]:
+            gate["active"] += 1
+            ticket.granted.set_result(True)
+            self.stats["admitted"] += 1
+        else:
+            bisect.insort(gate["waiting"], ticket, key=lambda t: t.rank)
+            self.stats["queued"] += 1
+            self.notify(gate)
+        return ticket
+
+    def position(self, ticket: LLMTicket) -> int:
+        """1-based place in the wait queue, 0 once generation may start"""
+        waiting = self.gate(ticket.model)["waiting"]
+        return waiting.index(ticket) + 1 if ticket in waiting else 0
+
+    async def wait_turn(self, ticket: LLMTicket) -> AsyncGenerator[int, None]:
+        """Yield the caller's queue position whenever it changes until a slot is granted"""
+        gate = self.gate(ticket.model)
+        last = None
+        while not ticket.granted.done():
+            position = self.position(ticket)
+            if position != last:
+                last = position
+                yield position
+            remaining = LLM_QUEUE_TIMEOUT - (time.monotonic() - ticket.enqueued_at)
+            if remaining <= 0:
+                self.stats["timed_out"] += 1
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"Model '{ticket.model}' is busy. Waited {LLM_QUEUE_TIMEOUT:g}s in queue."
+                )
+            moved = asyncio.ensure_future(gate["moved"].wait())
+            try:
+                await asyncio.wait({ticket.granted, moved}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                moved.cancel()
+
+    def release(self, ticket: LLMTicket):
+        """Give back a granted slot or leave the queue, then hand slots to the next waiters"""
+        gate = self.gate(ticket.model)
+        if ticket in gate["waiting"]:
+            gate["waiting"].remove(ticket)
+        elif ticket.granted.done():
+            gate["active"] -= 1
+        else:
+            return
+        while gate["active"] < gate["limit"] and gate["waiting"]:
+            nxt = gate["waiting"].pop(0)
+            gate["active"] += 1
+            nxt.granted.set_result(True)
+            self.stats["admitted"] += 1
+        self.notify(gate)
+
+    def notify(self, gate: Dict[str, Any]):
+        # 대기 중인 호출자들이 바뀐 순번을 다시 계산하도록 깨움
+        moved, gate["moved"] = gate["moved"], asyncio.Event()
+        moved.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "queue_max": LLM_QUEUE_MAX,
+            "queue_timeout": LLM_QUEUE_TIMEOUT,
+            **self.stats,
+            "models": {
+                model: {
+                    "limit": gate["limit"],
+                    "active": gate["active"],
+                    "waiting": len(gate["waiting"]),
+                    "waiting_batch": sum(1 for t in gate["waiting"] if t.rank[0] > 0),
+                }
+                for model, gate in self.gates.items()
+            },
+        }
+
+def get_llm_scheduler() -> LLMScheduler:
+    global _llm_scheduler
+    if _llm_scheduler is None:
+        _llm_scheduler = LLMScheduler()
+    return _llm_scheduler
+
+async def llm_stream(
+    prompt: str,
+    model: str,
+    system: Optional[str] = None,
+    priority: str = "interactive"
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Generate through the scheduler, as `queued` and `token` stream events"""
+    scheduler = get_llm_scheduler()
+    ticket = scheduler.admit(model, priority)
+    try:
+        async for position in scheduler.wait_turn(ticket):
+            yield {"event": "queued", "position": position, "model": model}
+        async for token in call_ollama_stream(prompt, model, system):
+            yield {"event": "token", "text": token}
+    finally:
+        scheduler.release(ticket)
+
+# ==================== 인덱스 상태 저장소 ====================
+_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    sha256 TEXT NOT NULL,
+    chunk_count INTEGER NOT NULL,
+    indexed_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_manifest_chunks ON file_manifest (chunk_count);
+CREATE INDEX IF NOT EXISTS idx_manifest_size ON file_manifest (size);
+CREATE INDEX IF NOT EXISTS idx_manifest_indexed_at ON file_manifest (indexed_at);
+CREATE TABLE IF NOT EXISTS document_texts (
+    sha256 TEXT PRIMARY KEY,
+    pages TEXT NOT NULL,
+    stored_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state_flags (
+    name TEXT PRIMARY KEY,
+    set_at TEXT NOT NULL
+);
+"""
+
+# /vectors 정렬 키 -> file_manifest 열
+CATALOG_SORTS = {"points": "chunk_count", "bytes": "size", "indexed_at": "indexed_at", "source": "path"}
+
+def get_state_db() -> sqlite3.Connection:
+    """Shared SQLite connection for index bookkeeping; callers hold _state_lock"""
+    global _state_db
+    with _state_lock:
+        if _state_db is None:
+            conn = sqlite3.connect(str(STATE_DB_PATH), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_STATE_SCHEMA)
+            _state_db = conn
+        return _state_db
+
+def file_sha256(fp: Path, block_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(fp, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def state_flag(name: str) -> bool:
+    db = get_state_db()
+    with _state_lock:
+        return db.execute("SELECT 1 FROM state_flags WHERE name = ?", (name,)).fetchone() is not None
+
+def set_state_flag(name: str):
+    db = get_state_db()
+    with _state_lock, db:
+        db.execute("INSERT OR IGNORE INTO state_flags (name, set_at) VALUES (?, ?)", (name, datetime.utcnow().isoformat()))
+
+def manifest_get(path: str) -> Optional[sqlite3.Row]:
+    db = get_state_db()
+    with _state_lock:
+        return db.execute("SELECT * FROM file_manifest WHERE path = ?", (path,)).fetchone()
+
+def manifest_put(path: str, size: int, mtime: float, sha256: str, chunk_count: int):
+    db = get_state_db()
+    with _state_lock, db:
+        db.execute(
+            "INSERT OR REPLACE INTO file_manifest (path, size, mtime, sha256, chunk_count, indexed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, size, mtime, sha256, chunk_count, datetime.utcnow().isoformat())
+        )
+
+def manifest_touch(path: str, size: int, mtime: float):
+    db = get_state_db()
+    with _state_lock, db:
+        db.execute("UPDATE file_manifest SET size = ?, mtime = ? WHERE path = ?", (size, mtime, path))
+
+def manifest_rows_under(root: Path) -> List[sqlite3.Row]:
+    prefix = str(root).rstrip(os.sep) + os.sep
+    db = get_state_db()
+    with _state_lock:
+        rows = db.execute("SELECT path, chunk_count, sha256 FROM file_manifest").fetchall()
+    return [r for r in rows if r["path"].startswith(prefix)]
+
+def manifest_delete(paths: List[str]):
+    db = get_state_db()
+    with _state_lock, db:
+        db.executemany("DELETE FROM file_manifest WHERE path = ?", [(p,) for p in paths])
+
+def manifest_clear():
+    db = get_state_db()
+    with _state_lock, db:
+        db.execute("DELETE FROM file_manifest")
+
+def document_text_path(sha256: str) -> Path:
+    return DOC_TEXT_DIR / f"{sha256}.txt.gz"
+
+def document_text_exists(sha256: str) -> bool:
+    db = get_state_db()
+    with _state_lock:
+        row = db.execute("SELECT 1 FROM document_texts WHERE sha256 = ?", (sha256,)).fetchone()
+    return row is not None and document_text_path(sha256).exists()
+
+def document_text_put(sha256: str, tmp: Path, pages: List[int]):
+    """Move a compressed extracted text written by extract_to_spool into the store"""
+    os.replace(tmp, document_text_path(sha256))
+    db = get_state_db()
+    with _state_lock, db:
+        db.execute(
+            "INSERT OR REPLACE INTO document_texts (sha256, pages, stored_at) VALUES (?, ?, ?)",
+            (sha256, json.dumps(pages), datetime.utcnow().isoformat())
+        )
+
+def document_text_get(sha256: str) -> Optional[Tuple[str, List[int]]]:
+    """Extracted text of a file version and its PDF page start offsets, or None if not stored"""
+    db = get_state_db()
+    with _state_lock:
+        row = db.execute("SELECT pages FROM document_texts WHERE sha256 = ?", (sha256,)).fetchone()
+    if row is None:
+        return None
+    try:
+        with gzip.open(document_text_path(sha256), "rt", encoding="utf-8", newline="") as f:
+            return f.read(), json.loads(row["pages"])
+    except FileNotFoundError:
+        return None
+
+def document_text_prune(candidates: Optional[List[str]] = None, stored_before: Optional[str] = None) -> int:
+    """Drop stored texts no indexed file refers to any more, among candidates or stored before a time if given.
+
+    Callers pass the hashes they just replaced or deleted, so texts of files
+    another ingest job has parsed but not yet recorded are left alone.
+    """
+    sql = "SELECT sha256 FROM document_texts WHERE sha256 NOT IN (SELECT sha256 FROM file_manifest)"
+    params: Tuple = ()
+    if stored_before is not None:
+        sql += " AND stored_at < ?"
+        params = (stored_before,)
+    db = get_state_db()
+    with _state_lock, db:
+        orphans = [row["sha256"] for row in db.execute(sql, params)]
+        if candidates is not None:
+            wanted = set(candidates)
+            orphans = [s for s in orphans if s in wanted]
+        db.executemany("DELETE FROM document_texts WHERE sha256 = ?", [(s,) for s in orphans])
+    for sha256 in orphans:
+        document_text_path(sha256).unlink(missing_ok=True)
+    return len(orphans)
+
+def sweep_document_texts() -> int:
+    """Remove texts stored before this process started that no indexed file refers to.
+
+    They were written by a run that was killed before recording its files;
+    texts stored since start may belong to a job still in progress.
+    """
+    removed = document_text_prune(stored_before=datetime.utcfromtimestamp(_started_at).isoformat())
+    db = get_state_db()
+    with _state_lock:
+        known = {row["sha256"] for row in db.execute("SELECT sha256 FROM document_texts")}
+    # document_text_put이 파일을 옮긴 뒤 행을 쓰기 전에 중단된 경우
+    for fp in DOC_TEXT_DIR.glob("*.txt.gz"):
+        if fp.name[:-len(".txt.gz")] not in known and fp.stat().st_mtime < _started_at:
+            fp.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+def catalog_totals() -> Dict[str, int]:
+    """Document, point and byte totals of everything indexed, from the manifest"""
+    db = get_state_db()
+    with _state_lock:
+        sources, points, size = db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(chunk_count), 0), COALESCE(SUM(size), 0) FROM file_manifest WHERE chunk_count > 0"
+        ).fetchone()
+    return {"sources": sources, "points": points, "bytes": size}
+
+def manifest_backfill(counts: Dict[str, int], indexed_at: Dict[str, str]):
+    """Add rows for sources that have points but no manifest row (indexed before the manifest).
+
+    The rows carry an empty hash and mtime -1, so the next ingest sees the
+    file as changed and re-indexes it, first deleting its points by source.
+    """
+    rows = []
+    for source, count in counts.items():
+        try:
+            size = Path(source).stat().st_size
+        except OSError:
+            size = 0
+        rows.append((source, size, -1.0, "", count, indexed_at.get(source) or datetime.utcnow().isoformat()))
+    db = get_state_db()
+    with _state_lock, db:
+        db.executemany(
+            "INSERT OR IGNORE INTO file_manifest (path, size, mtime, sha256, chunk_count, indexed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+def catalog_page(offset: int, limit: Optional[int], sort: str = "points", descending: bool = True) -> List[sqlite3.Row]:
+    """One page of indexed documents (all of them without limit); sort is a CATALOG_SORTS key"""
+    order = f"{CATALOG_SORTS[sort]} {'DESC' if descending else 'ASC'}, path"
+    db = get_state_db()
+    with _state_lock:
+        return db.execute(
+            f"SELECT path, size, sha256, chunk_count, indexed_at FROM file_manifest WHERE chunk_count > 0 "
+            f"ORDER BY {order} LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset)
+        ).fetchall()
+
+# ==================== 청크 저장소 ====================
+# Qdrant에는 PAYLOAD_INDEXES 필드만 두고 청크 본문과 위치 정보는 포인트 ID로 여기서 조회
+_CHUNK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    point_id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    text TEXT NOT NULL,
+    meta TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source);
+"""
+
+def get_chunk_db() -> sqlite3.Connection:
+    """Chunk text and non-filterable metadata keyed by point ID; callers hold _chunk_lock"""
+    global _chunk_db
+    if _chunk_db is None:
+        conn = sqlite3.connect(str(CHUNK_DB_PATH), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_CHUNK_SCHEMA)
+        _chunk_db = conn
+    return _chunk_db
+
+def qdrant_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a chunk payload stored in Qdrant: only the filterable fields"""
+    return {k: v for k, v in payload.items() if k in PAYLOAD_INDEXES}
+
+def chunk_store_put(ids: List[str], payloads: List[Dict[str, Any]]):
+    rows = []
+    for pid, payload in zip(ids, payloads):
+        meta = {k: v for k, v in payload.items() if k not in PAYLOAD_INDEXES and k != "text"}
+        rows.append((pid, payload.get("source", ""), payload.get("text", ""), json.dumps(meta, ensure_ascii=False)))
+    with _chunk_lock:
+        db = get_chunk_db()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO chunks (point_id, source, text, meta) VALUES (?, ?, ?, ?)", rows)
+
+def chunk_store_get(ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Stored fields (text, char/page/row ranges) of the given points in one lookup"""
+    found = {}
+    with _chunk_lock:
+        db = get_chunk_db()
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            for pid, text, meta in db.execute(
+                f"SELECT point_id, text, meta FROM chunks WHERE point_id IN ({','.join('?' * len(part))})", tuple(part)
+            ):
+                found[pid] = {**json.loads(meta), "text": text}
+    return found
+
+def chunk_store_delete_ids(ids: List[str]):
+    with _chunk_lock:
+        db = get_chunk_db()
+        with db:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                db.execute(f"DELETE FROM chunks WHERE point_id IN ({','.join('?' * len(part))})", tuple(part))
+
+def chunk_store_delete_source(source: str):
+    with _chunk_lock:
+        db = get_chunk_db()
+        with db:
+            db.execute("DELETE FROM chunks WHERE source = ?", (source,))
+
+def chunk_store_clear():
+    with _chunk_lock:
+        db = get_chunk_db()
+        with db:
+            db.execute("DELETE FROM chunks")
+
+def chunk_store_scan(batch: int = 1000) -> Iterable[List[Tuple[str, Dict[str, Any]]]]:
+    """All stored chunks as batches of (point_id, payload), in point ID order"""
+    last = ""
+    while True:
+        with _chunk_lock:
+            rows = get_chunk_db().execute(
+                "SELECT point_id, source, text FROM chunks WHERE point_id > ? ORDER BY point_id LIMIT ?", (last, batch)
+            ).fetchall()
+        if not rows:
+            return
+        yield [(pid, {"source": source, "text": text}) for pid, source, text in rows]
+        last = rows[-1][0]
+
+def qdrant_point_ids(ids: List[str]) -> List[Union[int, str]]:
+    """Chunk store keys back to Qdrant point IDs (collections indexed by older versions have integer IDs)"""
+    return [int(pid) if pid.isdigit() else pid for pid in ids]
+
+def hydrate_hits(hits: List[ScoredPoint]) -> List[ScoredPoint]:
+    """Fill the final hits' payloads with their stored text and metadata"""
+    stored = chunk_store_get([str(h.id) for h in hits])
+    for h in hits:
+        h.payload = {**stored.get(str(h.id), {}), **(h.payload or {})}
+    return hits
+
+def migrate_payload_text() -> int:
+    """Move text and metadata out of the payloads of points indexed before the chunk store"""
+    client = get_qdrant()
+    legacy = Filter(must_not=[IsEmptyCondition(is_empty=PayloadField(key="text"))])
+    moved = 0
+    while True:
+        # 옮긴 포인트는 조건에서 빠지므로 매번 처음부터 조회
+        batch, _ = client.scroll(
+            collection_name=COLLECTION_NAME, scroll_filter=legacy, limit=1000, with_payload=True, with_vectors=False
+        )
+        if not batch:
+            return moved
+        payloads = [p.payload or {} for p in batch]
+        chunk_store_put([str(p.id) for p in batch], payloads)
+        keys = sorted({k for pl in payloads for k in pl if k not in PAYLOAD_INDEXES})
+        # 이전 /ingest는 정수 ID를 썼으므로 문자열 키가 아닌 원래 ID로 지정
+        client.delete_payload(collection_name=COLLECTION_NAME, keys=keys, points=[p.id for p in batch], wait=True)
+        moved += len(batch)
+
+# ==================== 키워드 색인 (BM25) ====================
+_LEX_TOKEN = re.compile(r"[가-힣]+|[0-9a-z]+(?:[-_./][0-9a-z]+)*")
+_LEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lex_docs (
+    point_id TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lex_docs_source ON lex_docs (source);
+CREATE TABLE IF NOT EXISTS lex_postings (
+    term TEXT NOT NULL,
+    point_id TEXT NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, point_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_lex_postings_point ON lex_postings (point_id);
+"""
+
+def lexical_terms(text: str) -> List[str]:
+    """Index terms: Hangul runs as character bigrams, codes and words whole plus their parts"""
+    terms = []
+    for m in _LEX_TOKEN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        tok = m.group()
+        if "가" <= tok[0] <= "힣":
+            # 조사/어미가 붙은 복합어도 부분 일치하도록 2-gram
+            if len(tok) == 1:
+                terms.append(tok)
+            else:
+                terms.extend(tok[i:i + 2] for i in range(len(tok) - 1))
+        else:
+            terms.append(tok)
+            parts = re.split(r"[-_./]", tok)
+            if len(parts) > 1:
+                terms.extend(p for p in parts if p)
+    return terms
+
+def get_lexical_db() -> sqlite3.Connection:
+    """Inverted index of chunk text keyed by point ID; callers hold _lexical_lock"""
+    global _lexical_db
+    if _lexical_db is None:
+        conn = sqlite3.connect(str(LEXICAL_DB_PATH), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_LEX_SCHEMA)
+        docs, length = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM lex_docs").fetchone()
+        _lexical_stats.update(docs=docs, length=length)
+        _lexical_db = conn
+    return _lexical_db
+
+def _lexical_delete_where(db: sqlite3.Connection, where: str, params: Tuple):
+    docs, length = db.execute(f"SELECT COUNT(*), COALESCE(SUM(length), 0) FROM lex_docs WHERE {where}", params).fetchone()
+    if docs:
+        db.execute(f"DELETE FROM lex_postings WHERE point_id IN (SELECT point_id FROM lex_docs WHERE {where})", params)
+        db.execute(f"DELETE FROM lex_docs WHERE {where}", params)
+        _lexical_stats["docs"] -= docs
+        _lexical_stats["length"] -= length
+
+def lexical_index_put(ids: List[str], payloads: List[Dict[str, Any]]):
+    """Index (or re-index) chunk texts under their point IDs"""
+    docs = []
+    postings = []
+    for pid, payload in zip(ids, payloads):
+        counts: Dict[str, int] = {}
+        for term in lexical_terms(payload.get("text", "")):
+            counts[term] = counts.get(term, 0) + 1
+        docs.append((pid, payload.get("source", ""), sum(counts.values())))
+        postings.extend((term, pid, tf) for term, tf in counts.items())
+    with _lexical_lock:
+        db = get_lexical_db()
+        with db:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                _lexical_delete_where(db, f"point_id IN ({','.join('?' * len(part))})", tuple(part))
+            db.executemany("INSERT INTO lex_docs (point_id, source, length) VALUES (?, ?, ?)", docs)
+            db.executemany("INSERT INTO lex_postings (term, point_id, tf) VALUES (?, ?, ?)", postings)
+        _lexical_stats["docs"] += len(docs)
+        _lexical_stats["length"] += sum(d[2] for d in docs)
+
+def lexical_delete_ids(ids: List[str]):
+    with _lexical_lock:
+        db = get_lexical_db()
+        with db:
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                _lexical_delete_where(db, f"point_id IN ({','.join('?' * len(part))})", tuple(part))
+
+def lexical_delete_source(source: str):
+    with _lexical_lock:
+        db = get_lexical_db()
+        with db:
+            _lexical_delete_where(db, "source = ?", (source,))
+
+def lexical_clear():
+    with _lexical_lock:
+        db = get_lexical_db()
+        with db:
+            db.execute("DELETE FROM lex_postings")
+            db.execute("DELETE FROM lex_docs")
+        _lexical_stats.update(docs=0, length=0)
+
+def lexical_search(question: str, limit: int, sources: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+    """BM25 top `limit` (point_id, score), optionally restricted to sources.
+
+    Terms are scored rarest first. A common term (in more than LEXICAL_MAX_DF
+    of a large index or more than LEXICAL_MAX_POSTINGS chunks) only adds to the
+    scores of chunks a rarer term matched, so its posting list is never read
+    in full. A question made only of common terms has nothing to rank by and
+    returns no keyword hits, leaving the ranking to dense search.
+    """
+    terms = list(dict.fromkeys(lexical_terms(question)))
+    scores: Dict[str, float] = {}
+    with _lexical_lock:
+        db = get_lexical_db()
+        n_docs, total = _lexical_stats["docs"], _lexical_stats["length"]
+        if not terms or n_docs == 0:
+            return []
+        avgdl = total / n_docs
+        source_sql = ""
+        params: Tuple = ()
+        if sources:
+            source_sql = f" AND d.source IN ({','.join('?' * len(sources))})"
+            params = tuple(sources)
+        dfs = {}
+        for term in terms:
+            df = db.execute("SELECT COUNT(*) FROM lex_postings WHERE term = ?", (term,)).fetchone()[0]
+            if df:
+                dfs[term] = df
+        select = "SELECT p.point_id, p.tf, d.length FROM lex_postings p JOIN lex_docs d ON d.point_id = p.point_id WHERE p.term = ?"
+        for term in sorted(dfs, key=dfs.get):
+            df = dfs[term]
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            common = df > LEXICAL_MAX_POSTINGS or (n_docs >= LEXICAL_MAX_DF_MIN_DOCS and df > n_docs * LEXICAL_MAX_DF)
+            if not common:
+                rows = db.execute(select + source_sql, (term, *params)).fetchall()
+            elif not scores:
+                break  # 남은 용어도 모두 흔한 용어
+            else:
+                # 이미 찾은 청크만 기본 키 (term, point_id)로 조회
+                candidates = list(scores)
+                rows = []
+                for i in range(0, len(candidates), 500):
+                    part = candidates[i:i + 500]
+                    rows.extend(db.execute(
+                        select + f" AND p.point_id IN ({','.join('?' * len(part))})", (term, *part)
+                    ))
+            for pid, tf, length in rows:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avgdl)
+                scores[pid] = scores.get(pid, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+    return heapq.nlargest(limit, scores.items(), key=lambda kv: kv[1])
+
+def sync_lexical_index():
+    """Rebuild the keyword index from the chunk store when it disagrees with the collection"""
+    try:
+        if not collection_exists():
+            return
+        client = get_qdrant()
+        points = client.count(collection_name=COLLECTION_NAME, exact=True).count
+        with _lexical_lock:
+            get_lexical_db()
+            indexed = _lexical_stats["docs"]
+        if points == indexed:
+            return
+        log.info(f"Rebuilding keyword index ({indexed} indexed, {points} points)")
+        lexical_clear()
+        for batch in chunk_store_scan():
+            lexical_index_put([pid for pid, _ in batch], [payload for _, payload in batch])
+        log.info(f"✅ Keyword index rebuilt ({_lexical_stats['docs']} chunks)")
+    except Exception as e:
+        log.warning(f"Keyword index sync failed: {e}")
+
+def dense_search(qvec: np.ndarray, limit: int, sources: Optional[List[str]] = None) -> List[ScoredPoint]:
+    flt = None
+    if sources:
+        flt = Filter(must=[FieldCondition(key="source", match=MatchAny(any=sources))])
+    return get_qdrant().search(
+        collection_name=COLLECTION_NAME, query_vector=qvec, query_filter=flt, limit=limit,
+        search_params=collection_search_params()
+    )
+
+def score_points(ids: List[str], qvec: np.ndarray) -> List[ScoredPoint]:
+    """Cosine similarity of the question to the stored vectors of the given points"""
+    q = qvec / (np.linalg.norm(qvec) or 1.0)
+    scored = []
+    for p in get_qdrant().retrieve(collection_name=COLLECTION_NAME, ids=qdrant_point_ids(ids), with_payload=True, with_vectors=True):
+        vec = np.asarray(p.vector, dtype=np.float32)
+        score = float(np.dot(q, vec / (np.linalg.norm(vec) or 1.0)))
+        scored.append(ScoredPoint(id=p.id, version=0, score=score, payload=p.payload))
+    return scored
+
+def rrf_fuse(rankings: List[List[str]], limit: int, k: int = RRF_K) -> List[str]:
+    """Reciprocal rank fusion of ranked ID lists; return the top `limit` IDs"""
+    fused: Dict[str, float] = {}
+    for ranked in rankings:
+        for rank, pid in enumerate(ranked, start=1):
+            fused[pid] = fused.get(pid, 0.0) + 1.0 / (k + rank)
+    return heapq.nlargest(limit, fused, key=fused.get)
+
+async def hybrid_search(
+    question: str,
+    qvec: np.ndarray,
+    top_k: int,
+    sources: Optional[List[str]] = None
+) -> List[ScoredPoint]:
+    """Dense search fused with BM25 by reciprocal rank fusion.
+
+    Both retrievers return HYBRID_CANDIDATES x top_k candidates; the fused
+    top_k keep their cosine similarity as score, so lexical-only hits are
+    scored against their stored vectors. Only the returned hits are filled
+    with text from the chunk store.
+    """
+    if not HYBRID_SEARCH:
+        hits = await run_qdrant(dense_search, qvec, top_k, sources)
+        return await asyncio.to_thread(hydrate_hits, hits)
+
+    n = top_k * max(1, HYBRID_CANDIDATES)
+    # 키워드 검색은 SQLite만 읽으므로 Qdrant 실행기(임베디드는 단일 스레드) 밖에서 동시에 실행
+    dense, lexical = await asyncio.gather(
+        run_qdrant(dense_search, qvec, n, sources),
+        asyncio.to_thread(lexical_search, question, n, sources)
+    )
+    if not lexical:
+        return await asyncio.to_thread(hydrate_hits, dense[:top_k])
+
+    top = rrf_fuse([[str(h.id) for h in dense], [pid for pid, _ in lexical]], top_k)
+    by_id = {str(h.id): h for h in dense}
+    missing = [pid for pid in top if pid not in by_id]
+    if missing:
+        for h in await run_qdrant(score_points, missing, qvec):
+            by_id[str(h.id)] = h
+    return await asyncio.to_thread(hydrate_hits, [by_id[pid] for pid in top if pid in by_id])
+
+# ==================== 업로드 저장 ====================
+async def save_upload(file: UploadFile, dest: Path, max_bytes: int = 0) -> Tuple[int, str]:
+    """Stream an upload to dest in fixed-size blocks; return (size, sha256).
+
+    The file is written to a hidden .part file first and renamed into place, so
+    an aborted or oversized upload never leaves a partial document behind.
+    """
+    h = hashlib.sha256()
+    size = 0
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}.part")
+    try:
+        with open(tmp, "wb") as f:
+            while True:
+                block = await file.read(UPLOAD_BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if max_bytes and size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"파일 크기 제한을 초과했습니다: {dest.name} (최대 {max_bytes // (1024 * 1024)}MB)"
+                    )
+                h.update(block)
+                await asyncio.to_thread(f.write, block)
+        os.replace(tmp, dest)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return size, h.hexdigest()
+
+# ==================== 인제스트 파이프라인 ====================
+_PIPELINE_DONE = object()
+POINT_ID_NAMESPACE = uuid.UUID("6f0c1b7e-3a52-4c8e-9a3d-2d5b8f4e7c10")
+
+def point_id(source: str, chunk_id: int) -> str:
+    """Deterministic point ID, so re-indexing a file overwrites its previous points"""
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{source}#{chunk_id}"))
+
+def delete_points(ids: List[str]):
+    client = get_qdrant()
+    for i in range(0, len(ids), UPSERT_BATCH):
+        client.delete(
+            collection_name=COLLECTION_NAME,
+            points_selector=PointIdsList(points=ids[i:i + UPSERT_BATCH])
+        )
+    if ids:
+        lexical_delete_ids(ids)
+        chunk_store_delete_ids(ids)
+        bump_index_version("delete")
+
+def upsert_vectors(ids: List[str], vectors: np.ndarray, payloads: List[Dict[str, Any]]):
+    """Upload an (n, dim) vector matrix with its ids and payloads through the batch API.
+
+    Text and metadata go to the chunk store first, so a point is never
+    searchable before its text can be looked up; Qdrant gets the filterable fields.
+    """
+    chunk_store_put(ids, payloads)
+    # 행렬을 그대로 넘겨 PointStruct/float 리스트를 청크마다 만들지 않음
+    get_qdrant().upload_collection(
+        collection_name=COLLECTION_NAME,
+        vectors=vectors,
+        payload=[qdrant_payload(p) for p in payloads],
+        ids=ids,
+        batch_size=UPSERT_BATCH,
+        wait=True
+    )
+    lexical_index_put(ids, payloads)
+    bump_index_version("upsert")
+
+def delete_source_points(source: str):
+    flt = Filter(must=[FieldCondition(key="source", match=MatchValue(value=source))])
+    get_qdrant().delete(collection_name=COLLECTION_NAME, points_selector=FilterSelector(filter=flt))
+    lexical_delete_source(source)
+    chunk_store_delete_source(source)
+    bump_index_version("delete source")
+
+def plan_ingest_delta(
+    files: List[Path],
+    known_hashes: Optional[Dict[str, str]] = None
+) -> Tuple[List[Dict[str, Any]], int]:
+    """Compare files against the manifest; return (entries to index, unchanged count).
+
+    Size and mtime are checked first so unchanged files are never read; only
+    files whose stat changed are hashed to tell real edits from touches.
+    Hashes already computed while the file was written (uploads) are reused.
+    """
+    known_hashes = known_hashes or {}
+    changed = []
+    unchanged = 0
+    for fp in files:
+        try:
+            st = fp.stat()
+        except OSError as e:
+            log.warning(f"Cannot stat {fp}: {e}")
+            continue
+        row = manifest_get(str(fp))
+        if row and row["size"] == st.st_size and row["mtime"] == st.st_mtime:
+            unchanged += 1
+            continue
+        digest = known_hashes.get(str(fp)) or file_sha256(fp)
+        if row and row["sha256"] == digest:
+            manifest_touch(str(fp), st.st_size, st.st_mtime)
+            unchanged += 1
+            continue
+        changed.append({
+            "path": fp,
+            "size": st.st_size,
+            "mtime": st.st_mtime,
+            "sha256": digest,
+            # 해시가 없는 행(manifest_backfill)은 ID를 모르는 포인트이므로 source 단위로 지움
+            "previous_chunks": row["chunk_count"] if row and row["sha256"] else None,
+            "previous_sha256": row["sha256"] if row else None,
+        })
+    return changed, unchanged
+
+def prune_deleted_files(root: Path, present: set) -> int:
+    """Remove points and manifest rows of files that no longer exist under root"""
+    gone = [r for r in manifest_rows_under(root) if r["path"] not in present]
+    for row in gone:
+        if not row["sha256"]:
+            delete_source_points(row["path"])  # manifest_backfill로 추가된 행: 포인트 ID를 알 수 없음
+        else:
+            delete_points([point_id(row["path"], i) for i in range(row["chunk_count"])])
+    manifest_delete([r["path"] for r in gone])
+    document_text_prune([r["sha256"] for r in gone])
+    if gone:
+        log.info(f"Removed {len(gone)} deleted files from the index")
+    return len(gone)
+
+def finalize_file(entry: Dict[str, Any], chunk_count: int):
+    """Record a fully upserted file and drop points left over from a longer version"""
+    source = str(entry["path"])
+    previous = entry["previous_chunks"] or 0
+    if previous > chunk_count:
+        delete_points([point_id(source, i) for i in range(chunk_count, previous)])
+    manifest_put(source, entry["size"], entry["mtime"], entry["sha256"], chunk_count)
+    if entry["previous_sha256"] and entry["previous_sha256"] != entry["sha256"]:
+        document_text_prune([entry["previous_sha256"]])
+
+async def run_ingest_pipeline(
+    files: List[Path],
+    prune_root: Optional[Path] = None,
+    progress: Optional[Dict[str, Any]] = None,
+    known_hashes: Optional[Dict[str, str]] = None
+) -> Dict[str, int]:
+    """Staged read -> chunk -> embed -> upsert pipeline with bounded queues.
+
+    Only files that are new or changed according to the manifest are read.
+    Stages exchange windows of at most INGEST_WINDOW chunks, and each queue holds
+    at most INGEST_QUEUE_DEPTH items, so memory stays flat regardless of corpus
+    size and every window is searchable as soon as its upsert returns.
+    A file is recorded in the manifest only after its last chunk is upserted.
+    Stage counters are written into `progress` as they advance.
+    """
+    progress = progress if progress is not None else {}
+    progress["stage"] = "planning"
+    entries, unchanged = await asyncio.to_thread(plan_ingest_delta, files, known_hashes)
+    deleted = 0
+    if prune_root is not None:
+        deleted = await asyncio.to_thread(prune_deleted_files, prune_root, {str(f) for f in files})
+    log.info(f"Ingest plan: {len(entries)} new/changed, {unchanged} unchanged, {deleted} deleted")
+    progress.update(
+        stage="indexing", files_total=len(entries), files_skipped=unchanged, files_deleted=deleted,
+        files_done=0, chunks=0, vectors=0
+    )
+
+    text_q: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
+    chunk_q: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
+    vector_q: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_DEPTH)
+    stats = {"files": 0, "chunks": 0, "skipped": unchanged, "deleted": deleted}
+    stored_texts: List[str] = []  # 이번 실행이 저장한 추출 텍스트, 기록되지 못한 파일의 것은 끝에서 삭제
+
+    async def read_stage():
+        pending = iter(entries)
+
+        async def reader():
+            for entry in pending:
+                fp = entry["path"]
+                try:
+                    if entry["previous_chunks"] is None:
+                        # 매니페스트 도입 이전에 색인된 중복 포인트 정리
+                        await asyncio.to_thread(delete_source_points, str(fp))
+                    # 같은 내용의 텍스트가 이미 저장돼 있으면 다시 쓰지 않음
+                    text_path = None
+                    if not await asyncio.to_thread(document_text_exists, entry["sha256"]):
+                        text_path = SPOOL_DIR / f"{uuid.uuid4().hex}.txt.gz"
+                    spool = None
+                    parsed = await parse_file(fp, text_path=text_path)
+                    if parsed is not None:
+                        spool, info = parsed
+                        if text_path is not None:
+                            await asyncio.to_thread(document_text_put, entry["sha256"], text_path, info["pages"])
+                            stored_texts.append(entry["sha256"])
+                except Exception as e:
+                    log.error(f"Failed to process {fp}: {e}")
+                    continue
+                progress["files_done"] += 1
+                await text_q.put((entry, spool))
+
+        # 파서 워커 수만큼 파일을 동시에 파싱
+        await asyncio.gather(*(reader() for _ in range(max(1, PARSE_WORKERS))))
+        await text_q.put(_PIPELINE_DONE)
+
+    async def chunk_stage():
+        window = {"chunks": [], "completed": []}
+        while True:
+            item = await text_q.get()
+            if item is _PIPELINE_DONE:
+                break
+            entry, spool = item
+            fp = entry["path"]
+            indexed_at = datetime.utcnow().isoformat()
+            count = 0
+            if spool is not None:
+                try:
+                    with open(spool, encoding="utf-8") as f:
+                        while True:
+                            records = await asyncio.to_thread(read_spool_records, f, INGEST_WINDOW)
+                            if not records:
+                                break
+                            for rec in records:
+                                meta = {
+                                    "source": str(fp),
+                                    "filename": fp.name,
+                                    "file_type": fp.suffix.lower(),
+                                    "chunk_id": count,
+                                    "text": rec["text"],
+                                    "indexed_at": indexed_at
+                                }
+                                if "start" in rec:
+                                    meta["char_start"] = rec["start"]
+                                    meta["char_end"] = rec["end"]
+                                for key in ("page_start", "page_end", "sheet", "row_start", "row_end"):
+                                    if key in rec:
+                                        meta[key] = rec[key]
+                                window["chunks"].append(meta)
+                                count += 1
+                                progress["chunks"] += 1
+                                if len(window["chunks"]) >= INGEST_WINDOW:
+                                    await chunk_q.put(window)
+                                    window = {"chunks": [], "completed": []}
+                finally:
+                    spool.unlink(missing_ok=True)
+            if spool is None:
+                # 파싱 실패(시간 초과, 워커 종료, 잠긴 파일 등)는 일시적일 수 있으므로
+                # 매니페스트와 기존 포인트를 그대로 두어 다음 인제스트에서 다시 시도
+                continue
+            if count:
+                stats["files"] += 1
+            # 파일의 마지막 청크와 같은 (또는 이후) 윈도우가 업서트되면 완료 처리
+            window["completed"].append((entry, count))
+        if window["chunks"] or window["completed"]:
+            await chunk_q.put(window)
+        await chunk_q.put(_PIPELINE_DONE)
+
+    async def embed_stage():
+        while True:
+            window = await chunk_q.get()
+            if window is _PIPELINE_DONE:
+                break
+            vectors = None
+            if window["chunks"]:
+                vectors = await asyncio.to_thread(embed_texts_batch, [m["text"] for m in window["chunks"]])
+            await vector_q.put((window, vectors))
+        await vector_q.put(_PIPELINE_DONE)
+
+    async def upsert_stage():
+        # 원격 Qdrant는 여러 윈도우를 동시에 업로드, 임베디드 모드는 단일 작성자
+        parallel = 1 if QDRANT_LOCAL else max(1, UPSERT_PARALLEL)
+        inflight: List[Tuple[asyncio.Task, Dict[str, Any]]] = []
+
+        async def settle():
+            # 윈도우 순서대로 완료 처리: 파일의 모든 청크가 올라간 뒤에 manifest 기록
+            task, window = inflight.pop(0)
+            await task
+            for entry, count in window["completed"]:
+                await asyncio.to_thread(finalize_file, entry, count)
+            if window["chunks"]:
+                n = len(window["chunks"])
+                stats["chunks"] += n
+                progress["vectors"] += n
+                log.info(f"Upserted window of {n} chunks ({stats['chunks']} total)")
+
+        try:
+            while True:
+                item = await vector_q.get()
+                if item is _PIPELINE_DONE:
+                    break
+                window, vectors = item
+                if window["chunks"]:
+                    ids = [point_id(meta["source"], meta["chunk_id"]) for meta in window["chunks"]]
+                    task = asyncio.create_task(asyncio.to_thread(upsert_vectors, ids, vectors, window["chunks"]))
+                else:
+                    task = asyncio.create_task(asyncio.sleep(0))
+                inflight.append((task, window))
+                while len(inflight) >= parallel:
+                    await settle()
+            while inflight:
+                await settle()
+        finally:
+            for task, _ in inflight:
+                task.cancel()
+
+    tasks = [
+        asyncio.create_task(stage())
+        for stage in (read_stage, chunk_stage, embed_stage, upsert_stage)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        # 한 단계가 실패하면 나머지 단계가 큐에서 영원히 대기하지 않도록 취소
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+        while not text_q.empty():
+            item = text_q.get_nowait()
+            if item is not _PIPELINE_DONE and item[1] is not None:
+                item[1].unlink(missing_ok=True)
+        if stored_texts:
+            # 취소/실패로 매니페스트에 기록되지 못한 파일의 텍스트
+            document_text_prune(stored_texts)
+
+    progress["stage"] = "done"
+    return stats
+
+# ==================== 인제스트 작업 ====================
+class IngestJob:
+    """A queued ingest run whose progress can be polled, streamed and cancelled"""
+
+    def __init__(
+        self,
+        kind: str,
+        files: List[Path],
+        prune_root: Optional[Path] = None,
+        known_hashes: Optional[Dict[str, str]] = None
+    ):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.files = files
+        self.prune_root = prune_root
+        self.known_hashes = known_hashes
+        self.status = "queued"  # queued | running | completed | failed | cancelled
+        self.progress: Dict[str, Any] = {"stage": "queued", "files_total": len(files)}
+        self.result: Optional[Dict[str, int]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self.done = asyncio.Event()
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        self.done.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        elapsed = 0.0
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+
+        def rate(key: str) -> float:
+            return round(self.progress.get(key, 0) / elapsed, 2) if elapsed > 0 else 0.0
+
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "throughput": {
+                "files_per_s": rate("files_done"),
+                "chunks_per_s": rate("chunks"),
+                "vectors_per_s": rate("vectors"),
+            },
+            "elapsed": round(elapsed, 2),
+            "created_at": datetime.utcfromtimestamp(self.created_at).isoformat(),
+            "result": self.result,
+            "error": self.error,
+        }
+
+def ensure_job_workers():
+    """Start the bounded pool of ingest workers on first use"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = asyncio.Queue(maxsize=INGEST_JOB_QUEUE)
+    if not _job_workers:
+        # 임베디드 Qdrant는 작성자가 하나뿐이어야 하므로 작업도 하나씩 실행
+        workers = 1 if QDRANT_LOCAL else max(1, INGEST_JOB_WORKERS)
+        for _ in range(workers):
+            _job_workers.append(asyncio.create_task(ingest_job_worker()))
+        log.info(f"Started {len(_job_workers)} ingest job workers")
+
+def submit_ingest_job(
+    kind: str,
+    files: List[Path],
+    prune_root: Optional[Path] = None,
+    known_hashes: Optional[Dict[str, str]] = None
+) -> IngestJob:
+    ensure_job_workers()
+    job = IngestJob(kind, files, prune_root, known_hashes)
+    try:
+        _job_queue.put_nowait(job)
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=429, detail="Too many ingest jobs queued. Please retry later.")
+    _jobs[job.id] = job
+    _prune_finished_jobs()
+    log.info(f"Queued {kind} job {job.id} ({len(files)} files)")
+    return job
+
+def _prune_finished_jobs():
+    finished = [j for j in _jobs.values() if j.done.is_set()]
+    for job in finished[:max(0, len(finished) - JOB_RETENTION)]:
+        _jobs.pop(job.id, None)
+
+async def ingest_job_worker():
+    while True:
+        job = await _job_queue.get()
+        if job.status != "queued":
+            continue  # 대기 중에 취소됨
+        job.status = "running"
+        job.started_at = time.time()
+        job.task = asyncio.create_task(
+            run_ingest_pipeline(job.files, job.prune_root, job.progress, job.known_hashes)
+        )
+        await asyncio.wait({job.task})
+        if job.task.cancelled():
+            job.progress["stage"] = "cancelled"
+            job.finish("cancelled")
+            log.info(f"Ingest job {job.id} cancelled")
+        elif job.task.exception() is not None:
+            err = job.task.exception()
+            log.error(f"Ingest job {job.id} failed: {err}")
+            job.finish("failed", str(getattr(err, "detail", err)))
+        else:
+            job.result = job.task.result()
+            job.finish("completed")
+            log.info(f"Ingest job {job.id} completed: {job.result}")
+
+def cancel_ingest_job(job: IngestJob) -> bool:
+    if job.done.is_set():
+        return False
+    if job.task is None:
+        job.progress["stage"] = "cancelled"
+        job.finish("cancelled")
+    else:
+        job.task.cancel()
+    return True
+
+async def wait_ingest_job(job: IngestJob) -> Dict[str, int]:
+    """Wait for a job started by a synchronous request and return its stats"""
+    await job.done.wait()
+    if job.status == "cancelled":
+        raise HTTPException(status_code=409, detail=f"Ingest job {job.id} was cancelled")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error or "Ingest job failed")
+    return job.result
+
+def get_ingest_job(job_id: str) -> IngestJob:
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 # ==================== 스키마 ====================
 class IngestResponse(BaseModel):
     files_indexed: int
     chunks_indexed: int
+    files_skipped: int = 0
+    files_deleted: int = 0
     status: str = "success"
 
 class QueryRequest(BaseModel):
@@ -477,6 +3229,7 @@ class QueryRequest(BaseModel):
     temperature: Optional[float] = Field(default=0.7, ge=0, le=2)
     system_prompt: Optional[str] = None
     selected_sources: Optional[List[str]] = None  # 선택된 문서 소스 목록
+    priority: str = Field(default="interactive", pattern="^(interactive|batch)$")  # LLM 대기열 우선순위
 
     @validator('question')
     def question_not_empty(cls, v):
@@ -487,6 +3240,10 @@ class QueryRequest(BaseModel):
 class StorageConfig(BaseModel):
     path: str = Field(..., min_length=1)
 
+class ModelResidency(BaseModel):
+    model: str = Field(..., min_length=1)
+    keep_alive: Optional[str] = None  # pin 시 유지 시간, 기본은 무기한("-1")
+
 class ConversationExport(BaseModel):
     conversation_id: str
     title: str
@@ -504,7 +3261,7 @@ async def health():
         qdrant_error = None
         try:
             client = get_qdrant()
-            client.get_collections()
+            await run_qdrant(client.get_collections)
             qdrant_ok = True
         except Exception as e:
             qdrant_error = str(e)
@@ -585,41 +3342,35 @@ async def get_models_v1():
 async def query_v1(req: QueryRequest = Body(...)):
     """Query with RAG or LLM mode (API v1) - Non-streaming"""
     try:
-        client = get_qdrant()
         model = req.model or OLLAMA_MODEL
 
         if req.mode == "rag":
-            collections = [c.name for c in client.get_collections().collections]
-            if COLLECTION_NAME not in collections:
+            if not await has_collection():
                 raise HTTPException(status_code=404, detail="No documents indexed")
 
-            qvec = embed_texts_batch([req.question])[0]
-
-            search_params = {
-                "collection_name": COLLECTION_NAME,
-                "query_vector": qvec,
-                "limit": req.top_k,
-            }
-
-            if req.selected_sources and len(req.selected_sources) > 0:
-                from qdrant_client.models import Filter, FieldCondition, MatchAny
-                search_params["query_filter"] = Filter(
-                    must=[
-                        FieldCondition(
-                            key="source",
-                            match=MatchAny(any=req.selected_sources)
-                        )
-                    ]
-                )
+            version = _index_version
+            cached = answer_cache_get(req, model, version)
+            if cached is None:
+                qvec = await embed_query(req.question)
+                cached = answer_cache_get(req, model, version, qvec)
+            if cached is not None:
+                return {
+                    "answer": "".join(cached["tokens"]),
+                    "sources": cached["sources"],
+                    "mode": "rag",
+                    "cached": True
+                }
 
-            hits = client.search(**search_params)
+            hits = await hybrid_search(req.question, qvec, req.top_k, req.selected_sources)
             contexts = [{"payload": h.payload, "score": float(h.score)} for h in hits]
-            prompt = build_rag_prompt(req.question, contexts, req.language)
+            prompt, packing = build_rag_prompt(req.question, contexts, req.language, model)
 
             # Collect streaming response
-            answer = ""
-            async for token in call_ollama_stream(prompt, model):
-                answer += token
+            tokens = []
+            async for ev in llm_stream(prompt, model, rag_system_prompt(req.language), req.priority):
+                if ev["event"] == "token":
+                    tokens.append(ev["text"])
+            answer = "".join(tokens)
 
             sources = []
             for i, h in enumerate(hits, start=1):
@@ -630,13 +3381,17 @@ async def query_v1(req: QueryRequest = Body(...)):
                     "source": pl.get("source", "unknown"),
                     "filename": pl.get("filename", "unknown"),
                     "chunk_id": pl.get("chunk_id", 0),
+                    "page_start": pl.get("page_start"),
+                    "page_end": pl.get("page_end"),
                     "preview": pl.get("text", "")[:300]
                 })
+            answer_cache_put(req, model, version, qvec, sources, tokens)
 
             return {
                 "answer": answer,
                 "sources": sources,
-                "mode": "rag"
+                "mode": "rag",
+                "context": packing
             }
         else:
             # LLM mode
@@ -646,8 +3401,9 @@ async def query_v1(req: QueryRequest = Body(...)):
             )
 
             answer = ""
-            async for token in call_ollama_stream(req.question, model, system_prompt):
-                answer += token
+            async for ev in llm_stream(req.question, model, system_prompt, req.priority):
+                if ev["event"] == "token":
+                    answer += ev["text"]
 
             return {
                 "answer": answer,
@@ -667,18 +3423,11 @@ async def search_v1(
 ):
     """Vector search endpoint (API v1)"""
     try:
-        client = get_qdrant()
-        collections = [c.name for c in client.get_collections().collections]
-
-        if COLLECTION_NAME not in collections:
+        if not await has_collection():
             return {"results": [], "message": "No collection found"}
 
-        qvec = embed_texts_batch([query])[0]
-        hits = client.search(
-            collection_name=COLLECTION_NAME,
-            query_vector=qvec,
-            limit=top_k
-        )
+        qvec = await embed_query(query)
+        hits = await hybrid_search(query, qvec, top_k)
 
         results = []
         for h in hits:
@@ -688,6 +3437,8 @@ async def search_v1(
                 "source": pl.get("source", "unknown"),
                 "filename": pl.get("filename", "unknown"),
                 "chunk_id": pl.get("chunk_id", 0),
+                "page_start": pl.get("page_start"),
+                "page_end": pl.get("page_end"),
                 "text": pl.get("text", "")[:500]
             })
 
@@ -702,20 +3453,20 @@ async def query_stream_v1(req: QueryRequest = Body(...)):
     return await query_stream(req)
 
 @app.post("/api/v1/upload")
-async def upload_v1(files: List[UploadFile] = File(...)):
+async def upload_v1(files: List[UploadFile] = File(...), background: bool = Query(False)):
     """File upload endpoint (API v1)"""
-    return await upload_files(files)
+    return await upload_files(files, background)
 
 @app.get("/api/v1/collections")
 async def collections_v1():
     """Get collections info (API v1)"""
     try:
         client = get_qdrant()
-        collections = client.get_collections().collections
+        collections = (await run_qdrant(client.get_collections)).collections
 
         result = []
         for col in collections:
-            info = client.get_collection(col.name)
+            info = await run_qdrant(client.get_collection, col.name)
             result.append({
                 "name": col.name,
                 "vectors_count": info.vectors_count or 0,
@@ -727,6 +3478,110 @@ async def collections_v1():
         log.error(f"Collections query failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/cache/stats")
+def cache_stats():
+    """Embedding, query-embedding and answer cache counters, plus query batching histograms"""
+    return {
+        "embedding": embedding_cache_stats(),
+        "query": query_cache_stats(),
+        "answer": answer_cache_stats(),
+        "query_batching": get_query_batcher().stats()
+    }
+
+@app.get("/llm/queue")
+def llm_queue():
+    """Per-model generation slots and wait queues"""
+    return get_llm_scheduler().snapshot()
+
+@app.get("/admin/collection")
+async def admin_collection():
+    """Collection status and how it differs from COLLECTION_PROFILE"""
+    if not await has_collection():
+        return {"exists": False, "profile": COLLECTION_PROFILE, "settings": COLLECTION_PROFILES[COLLECTION_PROFILE]}
+    info = await run_qdrant(get_qdrant().get_collection, COLLECTION_NAME)
+    return {
+        "exists": True,
+        "status": str(info.status.value),
+        "points": info.points_count,
+        "indexed_vectors": info.indexed_vectors_count,
+        "profile": COLLECTION_PROFILE,
+        "settings": COLLECTION_PROFILES[COLLECTION_PROFILE],
+        # 임베디드 모드는 양자화/HNSW 없이 전수 검색하므로 비교하지 않음
+        "drift": {} if QDRANT_LOCAL else await run_qdrant(collection_profile_drift)
+    }
+
+@app.post("/admin/collection/migrate")
+async def admin_migrate_collection():
+    """Convert the existing collection to COLLECTION_PROFILE in place"""
+    if QDRANT_LOCAL:
+        raise HTTPException(status_code=400, detail="Embedded Qdrant always searches exactly; collection profiles apply to a Qdrant server")
+    if not await has_collection():
+        raise HTTPException(status_code=404, detail="Collection does not exist")
+    try:
+        drift = await run_qdrant(migrate_collection, COLLECTION_PROFILE)
+    except Exception as e:
+        log.error(f"Collection migration failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Collection migration failed: {e}")
+    if drift:
+        log.info(f"🔧 Migrating collection '{COLLECTION_NAME}' to profile '{COLLECTION_PROFILE}': {drift}")
+    return {"status": "migrating" if drift else "unchanged", "profile": COLLECTION_PROFILE, "changes": drift}
+
+@app.get("/admin/models")
+async def admin_models():
+    """Models resident in Ollama memory and the keep_alive each model gets"""
+    try:
+        loaded = await loaded_models()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Ollama not reachable: {e}")
+    names = set(_available_models) | {m["name"] for m in loaded} | set(_model_keep_alive)
+    return {
+        "loaded": loaded,
+        "keep_alive": {name: model_keep_alive(name) for name in sorted(names)},
+        "pinned": dict(_model_keep_alive),
+        "preload": OLLAMA_PRELOAD
+    }
+
+@app.post("/admin/models/pin")
+async def admin_pin_model(req: ModelResidency):
+    """Load a model and keep it resident (indefinitely unless keep_alive is given)"""
+    _model_keep_alive[req.model] = req.keep_alive or "-1"
+    if not await set_model_residency(req.model, model_keep_alive(req.model)):
+        _model_keep_alive.pop(req.model, None)
+        raise HTTPException(status_code=502, detail=f"Failed to load model '{req.model}'")
+    log.info(f"📌 Pinned {req.model} (keep_alive={model_keep_alive(req.model)})")
+    return {"status": "pinned", "model": req.model, "keep_alive": model_keep_alive(req.model)}
+
+@app.post("/admin/models/unpin")
+async def admin_unpin_model(req: ModelResidency):
+    """Return a pinned model to its configured keep_alive policy"""
+    _model_keep_alive.pop(req.model, None)
+    # 다음 요청까지 기다리지 않고 바로 원래 유지 시간으로 갱신
+    await set_model_residency(req.model, model_keep_alive(req.model))
+    return {"status": "unpinned", "model": req.model, "keep_alive": model_keep_alive(req.model)}
+
+@app.post("/admin/models/unload")
+async def admin_unload_model(req: ModelResidency):
+    """Drop any pin and evict the model from Ollama memory now"""
+    _model_keep_alive.pop(req.model, None)
+    if not await set_model_residency(req.model, 0):
+        raise HTTPException(status_code=502, detail=f"Failed to unload model '{req.model}'")
+    log.info(f"Unloaded {req.model}")
+    return {"status": "unloaded", "model": req.model}
+
+@app.get("/chunking/compare")
+async def chunking_compare(limit: int = Query(20, ge=1, le=500, description="비교에 사용할 문서 수")):
+    """Compare chunk counts and estimated embedding time of the chunkers on indexed documents"""
+    allowed = {".txt", ".md", ".pdf", ".docx"}  # CSV/XLSX는 청커와 무관하게 행 단위로 처리
+    files = []
+    for p in CURRENT_DATA_DIR.rglob("*"):
+        if p.is_file() and p.suffix.lower() in allowed:
+            files.append(p)
+            if len(files) >= limit:
+                break
+    if not files:
+        return {"files": 0, "message": "No documents to compare"}
+    return await asyncio.to_thread(compare_chunkers, files)
+
 @app.get("/config")
 def get_config():
     return {
@@ -735,14 +3590,40 @@ def get_config():
             "port": OLLAMA_PORT,
             "model": OLLAMA_MODEL,
             "available": _ollama_available,
-            "models": _available_models
+            "models": _available_models,
+            "context_tokens": LLM_CONTEXT_TOKENS,
+            "answer_tokens": LLM_ANSWER_TOKENS,
+            "preload": OLLAMA_PRELOAD,
+            "keep_alive": OLLAMA_KEEP_ALIVE,
+            "model_keep_alive": OLLAMA_MODEL_KEEP_ALIVE,
+            "timeouts": {
+                "connect": OLLAMA_CONNECT_TIMEOUT,
+                "first_byte": OLLAMA_FIRST_BYTE_TIMEOUT,
+                "idle": OLLAMA_IDLE_TIMEOUT
+            }
         },
         "storage": {
             "data_dir": str(CURRENT_DATA_DIR),
             "exports_dir": str(EXPORT_DIR),
             "qdrant_mode": "embedded" if QDRANT_LOCAL else f"remote:{QDRANT_HOST}:{QDRANT_PORT}",
+            "collection_profile": COLLECTION_PROFILE,
+        },
+        "chunk": {
+            "chunker": CHUNKER,
+            "size": CHUNK_SIZE,
+            "overlap": CHUNK_OVERLAP,
+            "tokens": CHUNK_TOKENS,
+            "overlap_tokens": CHUNK_OVERLAP_TOKENS,
+            "table_rows": TABLE_CHUNK_ROWS
+        },
+        "parsing": {"workers": PARSE_WORKERS, "timeout": PARSE_TIMEOUT},
+        "upload": {"max_file_mb": UPLOAD_MAX_FILE_MB, "max_total_mb": UPLOAD_MAX_TOTAL_MB},
+        "retrieval": {
+            "hybrid": HYBRID_SEARCH,
+            "candidates": HYBRID_CANDIDATES,
+            "rrf_k": RRF_K,
+            "keyword_chunks": _lexical_stats["docs"]
         },
-        "chunk": {"size": CHUNK_SIZE, "overlap": CHUNK_OVERLAP},
         "features": {
             "rag_mode": True,
             "llm_mode": True,
@@ -770,10 +3651,10 @@ async def set_storage(cfg: StorageConfig):
 
 
 @app.post("/ingest", response_model=IngestResponse)
-async def ingest_all():
-    return await ingest_internal()
+async def ingest_all(background: bool = Query(False, description="즉시 작업 ID를 반환하고 백그라운드에서 색인")):
+    return await ingest_internal(background=background)
 
-async def ingest_internal(saved_only: Optional[List[Path]] = None) -> IngestResponse:
+async def ingest_internal(saved_only: Optional[List[Path]] = None, background: bool = False):
     try:
         if saved_only:
             files = saved_only
@@ -787,117 +3668,111 @@ async def ingest_internal(saved_only: Optional[List[Path]] = None) -> IngestResp
         if not files:
             return IngestResponse(files_indexed=0, chunks_indexed=0, status="no_files")
 
-        em = get_embedding_model()
-        probe_vec = [v for v in em.embed(["test"], batch_size=1)][0]
-        vec_dim = len(probe_vec)
-        ensure_collection(vec_dim)
+        await run_qdrant(ensure_collection, get_embedding_dim())
 
-        client = get_qdrant()
-
-        all_texts = []
-        all_metadata = []
-        files_set = set()
+        # 전체 재색인일 때만 사라진 파일을 정리
+        job = submit_ingest_job("ingest", files, prune_root=None if saved_only else CURRENT_DATA_DIR)
+        if background:
+            return JSONResponse(status_code=202, content=job.snapshot())
+        stats = await wait_ingest_job(job)
 
-        for fp in files:
-            try:
-                text = read_file_text(fp)
-                if not text:
-                    continue
+        log.info(
+            f"Indexed {stats['files']} files, {stats['chunks']} chunks "
+            f"({stats['skipped']} unchanged, {stats['deleted']} deleted)"
+        )
 
-                files_set.add(str(fp))
-                chunk_id = 0
-
-                for chunk in chunk_text(text):
-                    all_texts.append(chunk)
-                    all_metadata.append({
-                        "source": str(fp),
-                        "filename": fp.name,
-                        "chunk_id": chunk_id,
-                        "text": chunk,
-                        "indexed_at": datetime.utcnow().isoformat()
-                    })
-                    chunk_id += 1
-            except Exception as e:
-                log.error(f"Failed to process {fp}: {e}")
-                continue
+        if not stats["chunks"] and not stats["deleted"]:
+            status = "up_to_date" if stats["skipped"] else "no_content"
+        else:
+            status = "success"
 
-        if not all_texts:
-            return IngestResponse(files_indexed=0, chunks_indexed=0, status="no_content")
+        return IngestResponse(
+            files_indexed=stats["files"],
+            chunks_indexed=stats["chunks"],
+            files_skipped=stats["skipped"],
+            files_deleted=stats["deleted"],
+            status=status
+        )
 
-        vectors = embed_texts_batch(all_texts)
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.error(f"Ingest failed: {e}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Indexing failed: {str(e)}")
 
-        points_data = []
-        base_id = int(time.time() * 1000000)
+@app.get("/jobs")
+def list_jobs():
+    """List queued, running and recently finished ingest jobs"""
+    jobs = [j.snapshot() for j in reversed(list(_jobs.values()))]
+    return {"jobs": jobs, "count": len(jobs)}
 
-        for i, (vec, meta) in enumerate(zip(vectors, all_metadata)):
-            points_data.append({
-                "id": base_id + i,
-                "vector": vec,
-                "payload": meta
-            })
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    return get_ingest_job(job_id).snapshot()
 
-        batch_size = UPSERT_BATCH
-        for i in range(0, len(points_data), batch_size):
-            batch = points_data[i:i+batch_size]
-            client.upsert(
-                collection_name=COLLECTION_NAME,
-                points=batch,
-                wait=True
-            )
+@app.get("/jobs/{job_id}/stream")
+async def job_stream(job_id: str):
+    """Stream job progress as NDJSON until the job finishes"""
+    job = get_ingest_job(job_id)
 
-        log.info(f"Indexed {len(files_set)} files, {len(all_texts)} chunks")
+    async def generate():
+        while not job.done.is_set():
+            yield json.dumps({"event": "progress", "job": job.snapshot()}) + "\n"
+            try:
+                await asyncio.wait_for(job.done.wait(), timeout=JOB_PROGRESS_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        event = {"completed": "done", "failed": "error"}.get(job.status, job.status)
+        yield json.dumps({"event": event, "job": job.snapshot()}) + "\n"
 
-        return IngestResponse(
-            files_indexed=len(files_set),
-            chunks_indexed=len(all_texts),
-            status="success"
-        )
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
 
-    except Exception as e:
-        log.error(f"Ingest failed: {e}\n{traceback.format_exc()}")
-        raise HTTPException(status_code=500, detail=f"Indexing failed: {str(e)}")
+@app.delete("/jobs/{job_id}")
+def job_cancel(job_id: str):
+    job = get_ingest_job(job_id)
+    if not cancel_ingest_job(job):
+        return {"job_id": job.id, "status": job.status, "cancelled": False}
+    log.info(f"Cancellation requested for ingest job {job.id}")
+    return {"job_id": job.id, "status": "cancelling" if job.task else job.status, "cancelled": True}
 
 @app.post("/query_stream")
 async def query_stream(req: QueryRequest = Body(...)):
     try:
+        # 대기열이 가득 찼으면 스트림을 열기 전에 바로 거절
+        get_llm_scheduler().check_capacity(req.model or OLLAMA_MODEL)
+
         async def generate():
             try:
                 model = req.model or OLLAMA_MODEL
 
                 # RAG 모드
                 if req.mode == "rag":
-                    client = get_qdrant()
-                    collections = [c.name for c in client.get_collections().collections]
-
-                    if COLLECTION_NAME not in collections:
+                    if not await has_collection():
                         yield json.dumps({"event": "error", "message": "No documents indexed"}) + "\n"
                         return
 
-                    yield json.dumps({"event": "progress", "stage": "embedding", "pct": 10}) + "\n"
-                    qvec = embed_texts_batch([req.question])[0]
+                    version = _index_version
+                    cached = answer_cache_get(req, model, version)
+                    if cached is None:
+                        yield json.dumps({"event": "progress", "stage": "embedding", "pct": 10}) + "\n"
+                        qvec = await embed_query(req.question)
+                        cached = answer_cache_get(req, model, version, qvec)
+
+                    if cached is not None:
+                        # 같은 색인 버전에서 이미 생성된 답변: 검색/생성 없이 그대로 재생
+                        yield json.dumps({"event": "progress", "stage": "cached", "pct": 50}) + "\n"
+                        yield json.dumps({"event": "sources", "items": cached["sources"]}) + "\n"
+                        for token in cached["tokens"]:
+                            yield json.dumps({"event": "token", "text": token}) + "\n"
+                        yield json.dumps({"event": "done", "pct": 100, "cached": True}) + "\n"
+                        return
 
                     yield json.dumps({"event": "progress", "stage": "searching", "pct": 30}) + "\n"
 
                     # 선택된 문서가 있으면 필터 적용
-                    search_params = {
-                        "collection_name": COLLECTION_NAME,
-                        "query_vector": qvec,
-                        "limit": req.top_k,
-                    }
-
-                    if req.selected_sources and len(req.selected_sources) > 0:
-                        from qdrant_client.models import Filter, FieldCondition, MatchAny
-                        search_params["query_filter"] = Filter(
-                            must=[
-                                FieldCondition(
-                                    key="source",
-                                    match=MatchAny(any=req.selected_sources)
-                                )
-                            ]
-                        )
+                    if req.selected_sources:
                         log.info(f"Filtering by {len(req.selected_sources)} selected sources")
-
-                    hits = client.search(**search_params)
+                    hits = await hybrid_search(req.question, qvec, req.top_k, req.selected_sources)
 
                     sources = []
                     for i, h in enumerate(hits, start=1):
@@ -908,6 +3783,8 @@ async def query_stream(req: QueryRequest = Body(...)):
                             "source": pl.get("source", "unknown"),
                             "filename": pl.get("filename", "unknown"),
                             "chunk_id": pl.get("chunk_id", 0),
+                            "page_start": pl.get("page_start"),
+                            "page_end": pl.get("page_end"),
                             "preview": pl.get("text", "")[:300]
                         })
 
@@ -915,10 +3792,19 @@ async def query_stream(req: QueryRequest = Body(...)):
                     yield json.dumps({"event": "progress", "stage": "generating", "pct": 50}) + "\n"
 
                     contexts = [{"payload": h.payload, "score": float(h.score)} for h in hits]
-                    prompt = build_rag_prompt(req.question, contexts, req.language)
+                    prompt, packing = build_rag_prompt(req.question, contexts, req.language, model)
+                    log.info(
+                        f"Context: {packing['passages']} passages, {packing['context_tokens']} tokens "
+                        f"({packing['saved_tokens']} saved)"
+                    )
+                    yield json.dumps({"event": "context", **packing}) + "\n"
 
-                    async for token in call_ollama_stream(prompt, model):
-                        yield json.dumps({"event": "token", "text": token}) + "\n"
+                    tokens = []
+                    async for ev in llm_stream(prompt, model, rag_system_prompt(req.language), req.priority):
+                        if ev["event"] == "token":
+                            tokens.append(ev["text"])
+                        yield json.dumps(ev) + "\n"
+                    answer_cache_put(req, model, version, qvec, sources, tokens)
 
                 # 일반 LLM 모드
                 else:
@@ -929,8 +3815,8 @@ async def query_stream(req: QueryRequest = Body(...)):
                         else "You are a helpful AI assistant."
                     )
 
-                    async for token in call_ollama_stream(req.question, model, system_prompt):
-                        yield json.dumps({"event": "token", "text": token}) + "\n"
+                    async for ev in llm_stream(req.question, model, system_prompt, req.priority):
+                        yield json.dumps(ev) + "\n"
 
                 yield json.dumps({"event": "done", "pct": 100}) + "\n"
 
@@ -940,181 +3826,113 @@ async def query_stream(req: QueryRequest = Body(...)):
 
         return StreamingResponse(generate(), media_type="application/x-ndjson")
 
+    except HTTPException:
+        raise
     except Exception as e:
         log.error(f"Query stream failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/vectors")
-def vectors_summary():
+def vectors_summary(
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=10000, description="생략하면 전체 목록"),
+    sort: str = Query("points", pattern="^(points|bytes|indexed_at|source)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$")
+):
+    """Indexed documents from the file manifest, which ingest and delete keep in step with the collection"""
     try:
-        client = get_qdrant()
-        collections = [c.name for c in client.get_collections().collections]
-
-        if COLLECTION_NAME not in collections:
-            return {"collection": COLLECTION_NAME, "total_points": 0, "sources": []}
-
-        by_src: Dict[str, int] = {}
-        total = 0
-
-        scroll_result = client.scroll(
-            collection_name=COLLECTION_NAME,
-            limit=10000,
-            with_payload=True,
-        )
-
-        for pt in scroll_result[0]:
-            src = (pt.payload or {}).get("source", "unknown")
-            by_src[src] = by_src.get(src, 0) + 1
-            total += 1
-
-        items = [{"source": k, "points": v} for k, v in sorted(by_src.items(), key=lambda x: (-x[1], x[0]))]
+        if not collection_exists():
+            return {"collection": COLLECTION_NAME, "total_points": 0, "total_sources": 0, "total_bytes": 0, "sources": []}
+
+        totals = catalog_totals()
+        items = [
+            {
+                "source": row["path"],
+                "filename": Path(row["path"]).name,
+                "points": row["chunk_count"],
+                "bytes": row["size"],
+                "indexed_at": row["indexed_at"],
+                "sha256": row["sha256"]
+            }
+            for row in catalog_page(offset, limit, sort, order == "desc")
+        ]
 
-        return {"collection": COLLECTION_NAME, "total_points": total, "sources": items}
+        return {
+            "collection": COLLECTION_NAME,
+            "total_points": totals["points"],
+            "total_sources": totals["sources"],
+            "total_bytes": totals["bytes"],
+            "offset": offset,
+            "limit": limit,
+            "sources": items
+        }
 
     except Exception as e:
         log.error(f"Vector summary failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)):
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    background: bool = Query(False, description="저장 후 즉시 작업 ID를 반환하고 백그라운드에서 색인")
+):
     """파일 업로드 및 벡터 색인"""
     try:
         if not files:
             raise HTTPException(status_code=400, detail="파일이 제공되지 않았습니다")
 
-        # 파일 저장 및 처리
+        # 파일 저장 (블록 단위 스트리밍, 저장하면서 해시 계산)
         uploaded_files = []
+        file_hashes: Dict[str, str] = {}
+        total_bytes = 0
+        total_limit = UPLOAD_MAX_TOTAL_MB * 1024 * 1024
         for file in files:
             if not file.filename:
                 continue
 
-            # 파일 저장
-            file_path = CURRENT_DATA_DIR / file.filename
-            content = await file.read()
-
-            with open(file_path, 'wb') as f:
-                f.write(content)
-
-            log.info(f"File saved: {file.filename} ({len(content)} bytes)")
+            file_path = CURRENT_DATA_DIR / Path(file.filename).name
+            max_bytes = UPLOAD_MAX_FILE_MB * 1024 * 1024
+            if total_limit:
+                remaining = total_limit - total_bytes
+                max_bytes = min(max_bytes, remaining) if max_bytes else remaining
+                if max_bytes <= 0:
+                    raise HTTPException(status_code=413, detail=f"요청 크기 제한을 초과했습니다 (최대 {UPLOAD_MAX_TOTAL_MB}MB)")
+            size, digest = await save_upload(file, file_path, max_bytes)
+            total_bytes += size
+
+            log.info(f"File saved: {file_path.name} ({size} bytes)")
             uploaded_files.append(str(file_path))
+            file_hashes[str(file_path)] = digest
 
         if not uploaded_files:
             raise HTTPException(status_code=400, detail="유효한 파일이 없습니다")
 
-        # 파일 읽기 및 청킹
-        all_chunks = []
+        # 파일 읽기, 청킹, 임베딩, 업로드 (변경되지 않은 파일은 건너뜀)
         log.info(f"Processing {len(uploaded_files)} uploaded files...")
+        await run_qdrant(ensure_collection, get_embedding_dim())
+        job = submit_ingest_job("upload", [Path(f) for f in uploaded_files], known_hashes=file_hashes)
+        if background:
+            return JSONResponse(status_code=202, content={
+                **job.snapshot(),
+                "filenames": [Path(f).name for f in uploaded_files],
+                "uploaded_paths": uploaded_files
+            })
+        stats = await wait_ingest_job(job)
 
-        for fpath_str in uploaded_files:
-            fpath = Path(fpath_str)
-            log.info(f"Processing file: {fpath}")
-
-            try:
-                # 텍스트 추출
-                text = read_file_text(fpath)
-                log.info(f"Extracted text length: {len(text) if text else 0} chars")
-
-                if not text or not text.strip():
-                    log.warning(f"Empty or whitespace-only text from {fpath.name}")
-                    log.warning(f"Text content preview: '{text[:100] if text else 'None'}'")
-                    continue
-
-                log.info(f"Text preview (first 200 chars): {text[:200]}")
-
-                # 청킹
-                chunks_list = list(chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP))
-                log.info(f"File {fpath.name}: {len(chunks_list)} chunks created")
-
-                if chunks_list:
-                    log.info(f"First chunk preview: {chunks_list[0][:100]}")
-
-                for i, chunk_content in enumerate(chunks_list):
-                    all_chunks.append({
-                        "text": chunk_content,
-                        "source": str(fpath),
-                        "filename": fpath.name,
-                        "chunk_id": i
-                    })
-
-            except Exception as e:
-                log.error(f"Failed to process {fpath.name}: {e}")
-                import traceback
-                log.error(traceback.format_exc())
-                continue
-
-        log.info(f"Total chunks created: {len(all_chunks)}")
+        log.info(f"Total chunks created: {stats['chunks']} ({stats['skipped']} files unchanged)")
 
-        if not all_chunks:
+        if not stats["chunks"] and not stats["skipped"]:
             log.error("No chunks created from any file!")
             raise HTTPException(status_code=400, detail="처리 가능한 텍스트가 없습니다")
 
-        # 임베딩 생성
-        log.info(f"Generating embeddings for {len(all_chunks)} chunks...")
-        texts = [c["text"] for c in all_chunks]
-
-        em = get_embedding_model()
-        embeddings = []
-
-        for batch_start in range(0, len(texts), FASTEMBED_BATCH):
-            batch_end = min(batch_start + FASTEMBED_BATCH, len(texts))
-            batch_texts = texts[batch_start:batch_end]
-
-            for vec in em.embed(batch_texts, batch_size=len(batch_texts)):
-                embeddings.append(vec.tolist())
-
-        if len(embeddings) != len(all_chunks):
-            raise HTTPException(
-                status_code=500,
-                detail=f"임베딩 개수 불일치: {len(embeddings)} vs {len(all_chunks)}"
-            )
-
-        # Qdrant 컬렉션 준비
-        client = get_qdrant()
-        collections = [c.name for c in client.get_collections().collections]
-
-        if COLLECTION_NAME not in collections:
-            dim = len(embeddings[0])
-            client.create_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
-            )
-            log.info(f"Created collection: {COLLECTION_NAME}")
-
-        # 벡터 업로드
-        from qdrant_client.models import PointStruct
-
-        points = []
-        for idx, (chunk, vec) in enumerate(zip(all_chunks, embeddings)):
-            points.append(
-                PointStruct(
-                    id=str(uuid.uuid4()),
-                    vector=vec,
-                    payload={
-                        "text": chunk["text"],
-                        "source": chunk["source"],
-                        "filename": chunk["filename"],
-                        "chunk_id": chunk["chunk_id"]
-                    }
-                )
-            )
-
-        # 배치 업로드
-        for batch_start in range(0, len(points), UPSERT_BATCH):
-            batch_end = min(batch_start + UPSERT_BATCH, len(points))
-            batch_points = points[batch_start:batch_end]
-
-            client.upsert(
-                collection_name=COLLECTION_NAME,
-                points=batch_points
-            )
-
-        log.info(f"Uploaded {len(points)} vectors to Qdrant")
+        log.info(f"Uploaded {stats['chunks']} vectors to Qdrant")
 
         return {
             "status": "success",
             "files": len(uploaded_files),
-            "chunks": len(all_chunks),
-            "vectors": len(points),
+            "chunks": stats["chunks"],
+            "vectors": stats["chunks"],
+            "skipped": stats["skipped"],
             "filenames": [Path(f).name for f in uploaded_files],
             "uploaded_paths": uploaded_files  # 전체 경로 반환 (자동 선택용)
         }
@@ -1128,29 +3946,27 @@ async def upload_files(files: List[UploadFile] = File(...)):
 @app.delete("/vectors")
 def vectors_delete(source: Optional[str] = Query(None), delete_all: bool = Query(False)):
     try:
-        client = get_qdrant()
-        collections = [c.name for c in client.get_collections().collections]
-
-        if COLLECTION_NAME not in collections:
+        if not collection_exists():
             return {"deleted": 0, "status": "no_collection"}
 
         if delete_all:
-            em = get_embedding_model()
-            probe_vec = [v for v in em.embed(["test"], batch_size=1)][0]
-            dim = len(probe_vec)
-
-            client.recreate_collection(
-                collection_name=COLLECTION_NAME,
-                vectors_config=VectorParams(size=dim, distance=Distance.COSINE),
-            )
+            create_collection(get_embedding_dim())
+            manifest_clear()
+            lexical_clear()
+            chunk_store_clear()
+            document_text_prune()
+            bump_index_version("delete all")
             log.info("Deleted all vectors")
             return {"deleted": "all", "status": "success"}
 
         if not source:
             raise HTTPException(status_code=400, detail="source or delete_all required")
 
-        flt = Filter(must=[FieldCondition(key="source", match=MatchValue(value=source))])
-        client.delete(collection_name=COLLECTION_NAME, points_selector=FilterSelector(filter=flt))
+        row = manifest_get(source)
+        delete_source_points(source)
+        manifest_delete([source])
+        if row is not None:
+            document_text_prune([row["sha256"]])
 
         log.info(f"Deleted vectors for source: {source}")
         return {"deleted": "by_source", "source": source, "status": "success"}
@@ -1173,11 +3989,12 @@ async def export_conversation(conv: ConversationExport):
 @app.get("/document/source")
 async def get_document_source(
     path: str = Query(..., description="문서 파일 경로"),
-    chunk_id: Optional[int] = Query(None, description="청크 ID (하이라이트할 청크)")
+    chunk_id: Optional[int] = Query(None, description="청크 ID (하이라이트할 청크)"),
+    scope: str = Query("document", pattern="^(document|page)$", description="page: PDF 청크가 속한 페이지만 반환")
 ):
     """원본 문서 내용 가져오기 - PDF, DOCX, TXT, MD, CSV, XLSX 지원"""
     try:
-        log.info(f"📄 원본 문서 요청: {path}, chunk_id: {chunk_id}")
+        log.info(f"📄 원본 문서 요청: {path}, chunk_id: {chunk_id}, scope: {scope}")
 
         # 파일 경로 검증
         file_path = Path(path)
@@ -1190,53 +4007,76 @@ async def get_document_source(
             log.warning(f"파일이 아님: {path}")
             raise HTTPException(status_code=400, detail="올바른 파일이 아닙니다")
 
-        # read_file_text 함수를 사용하여 모든 파일 형식 지원
-        content = read_file_text(file_path)
+        # 청크 정보 가져오기 (chunk_id가 제공된 경우)
+        chunk_payload = None
+        if chunk_id is not None:
+            try:
+                # 포인트 ID는 source와 chunk_id로 정해지므로 청크 저장소에서 바로 조회
+                pid = point_id(str(file_path), chunk_id)
+                chunk_payload = (await asyncio.to_thread(chunk_store_get, [pid])).get(pid)
+            except Exception as e:
+                log.warning(f"청크 정보 가져오기 실패: {e}")
+
+        page_start = (chunk_payload or {}).get("page_start")
+        page_end = (chunk_payload or {}).get("page_end")
+
+        # 색인 시 저장한 추출 텍스트: 파일이 그 뒤로 바뀌지 않았으면 다시 파싱하지 않고 사용
+        stored = None
+        row = await asyncio.to_thread(manifest_get, str(file_path))
+        if row is not None:
+            st = file_path.stat()
+            if row["size"] == st.st_size and row["mtime"] == st.st_mtime:
+                stored = await asyncio.to_thread(document_text_get, row["sha256"])
+
+        offset = 0
+        if stored is not None:
+            content, pages = stored
+            if scope == "page" and page_start is not None and len(pages) >= page_start:
+                offset = pages[page_start - 1]
+                end = pages[page_end] - 1 if page_end < len(pages) else len(content)
+                content = content[offset:end]
+        elif scope == "page" and page_start is not None:
+            # 청크가 속한 페이지만 읽어 전체 문서 파싱을 피함
+            content = "\n".join(
+                text for _, text in iter_pdf_pages(file_path, first=page_start, last=page_end)
+            )
+        else:
+            # read_file_text 함수를 사용하여 모든 파일 형식 지원
+            content = read_file_text(file_path)
 
         if not content:
             log.warning(f"파일 내용이 비어있음: {path}")
             raise HTTPException(status_code=400, detail="파일 내용을 읽을 수 없습니다")
 
-        log.info(f"✅ 원본 문서 로드 완료: {len(content)} 문자")
+        log.info(f"✅ 원본 문서 로드 완료: {len(content)} 문자 ({'저장된 텍스트' if stored is not None else '원본 파싱'})")
 
-        # 청크 정보 가져오기 (chunk_id가 제공된 경우)
         chunk_info = None
-        if chunk_id is not None:
-            try:
-                # Qdrant에서 해당 청크 검색
-                client = get_qdrant()
-                collections = [c.name for c in client.get_collections().collections]
-
-                if COLLECTION_NAME in collections:
-                    # source와 chunk_id로 필터링하여 검색
-                    scroll_result = client.scroll(
-                        collection_name=COLLECTION_NAME,
-                        scroll_filter=Filter(
-                            must=[
-                                FieldCondition(key="source", match=MatchValue(value=str(file_path))),
-                                FieldCondition(key="chunk_id", match=MatchValue(value=chunk_id))
-                            ]
-                        ),
-                        limit=1,
-                        with_payload=True
-                    )
-
-                    if scroll_result[0]:
-                        chunk_payload = scroll_result[0][0].payload
-                        chunk_text = chunk_payload.get("text", "")
-
-                        # 원본 문서에서 청크 위치 찾기
-                        chunk_start = content.find(chunk_text[:100])  # 청크의 첫 100자로 검색
-                        if chunk_start != -1:
-                            chunk_info = {
-                                "chunk_id": chunk_id,
-                                "text": chunk_text,
-                                "start_pos": chunk_start,
-                                "end_pos": chunk_start + len(chunk_text)
-                            }
-                            log.info(f"✅ 청크 위치 찾음: {chunk_start} - {chunk_start + len(chunk_text)}")
-            except Exception as e:
-                log.warning(f"청크 정보 가져오기 실패: {e}")
+        if chunk_payload:
+            chunk_text = chunk_payload.get("text", "")
+            if stored is not None and "char_start" in chunk_payload:
+                # 청킹 시 기록한 정확한 위치
+                chunk_start = chunk_payload["char_start"] - offset
+                chunk_end = chunk_payload["char_end"] - offset
+            else:
+                needle = chunk_text
+                if "row_start" in chunk_payload:
+                    # 표 청크 앞에 붙은 시트명/헤더 줄은 원문 위치 검색에서 제외
+                    header_lines = 2 if chunk_payload.get("sheet") is not None else 1
+                    needle = "\n".join(chunk_text.split("\n")[header_lines:]) or chunk_text
+
+                # 원본 문서에서 청크 위치 찾기
+                chunk_start = content.find(needle[:100])  # 청크의 첫 100자로 검색
+                chunk_end = chunk_start + len(needle)
+            if 0 <= chunk_start <= chunk_end <= len(content):
+                chunk_info = {
+                    "chunk_id": chunk_id,
+                    "text": chunk_text,
+                    "start_pos": chunk_start,
+                    "end_pos": chunk_end,
+                    "page_start": page_start,
+                    "page_end": page_end
+                }
+                log.info(f"✅ 청크 위치 찾음: {chunk_start} - {chunk_end}")
 
         return {
             "status": "success",
@@ -1245,6 +4085,9 @@ async def get_document_source(
             "file_type": file_path.suffix.lower(),
             "size": len(content),
             "content": content,
+            "scope": "page" if scope == "page" and page_start is not None else "document",
+            "page_start": page_start,
+            "page_end": page_end,
             "chunk_info": chunk_info
         }
 
@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def index_state(tmp_path, monkeypatch):
+    """Point every SQLite store, the text store and embedded Qdrant at a temporary directory"""
+    for name, path in (
+        ("STATE_DB_PATH", tmp_path / "index_state.db"),
+        ("CHUNK_DB_PATH", tmp_path / "chunk_store.db"),
+        ("LEXICAL_DB_PATH", tmp_path / "lexical_index.db"),
+        ("EMBED_CACHE_DB_PATH", tmp_path / "embedding_cache.db"),
+        ("DOC_TEXT_DIR", tmp_path / "documents"),
+        ("SPOOL_DIR", tmp_path / "spool"),
+        ("QDRANT_DIR", tmp_path / "qdrant"),
+    ):
+        monkeypatch.setattr(main, name, path)
+    (tmp_path / "documents").mkdir()
+    (tmp_path / "spool").mkdir()
+    for name in ("_state_db", "_chunk_db", "_lexical_db", "_embed_cache_db", "_qdrant", "_collection_state"):
+        monkeypatch.setattr(main, name, None)
+    monkeypatch.setattr(main, "_lexical_stats", {"docs": 0, "length": 0})
+    yield tmp_path
+    for name in ("_state_db", "_chunk_db", "_lexical_db", "_embed_cache_db", "_qdrant"):
+        handle = getattr(main, name)
+        if handle is not None:
+            handle.close()
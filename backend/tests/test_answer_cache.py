@@ -0,0 +1,78 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def answer_cache(monkeypatch):
+    monkeypatch.setattr(main, "_answer_cache", OrderedDict())
+    monkeypatch.setattr(main, "_answer_cache_stats", {"hits": 0, "semantic_hits": 0, "misses": 0, "evictions": 0})
+    monkeypatch.setattr(main, "_index_version", 0)
+    monkeypatch.setattr(main, "ANSWER_CACHE_SIZE", 8)
+    monkeypatch.setattr(main, "ANSWER_CACHE_TTL", 60)
+    monkeypatch.setattr(main, "ANSWER_CACHE_SIMILARITY", 0)
+
+
+def req(question="What is RAG?", **kwargs):
+    return main.QueryRequest(question=question, **kwargs)
+
+
+def put(request, version=0, tokens=("answer",)):
+    main.answer_cache_put(request, "m", version, np.ones(4, dtype=np.float32), [], list(tokens))
+
+
+def test_key_ignores_whitespace_and_source_order():
+    put(req("What  is　RAG?", selected_sources=["b", "a"]))
+    assert main.answer_cache_get(req(selected_sources=["a", "b", "a"]), "m", 0)["tokens"] == ["answer"]
+    assert main.answer_cache_get(req(selected_sources=["a"]), "m", 0) is None
+    assert main.answer_cache_get(req(selected_sources=["a", "b"], top_k=3), "m", 0) is None
+    assert main.answer_cache_get(req(selected_sources=["a", "b"]), "other", 0) is None
+
+
+def test_index_change_invalidates_answers():
+    put(req())
+    main.bump_index_version("upsert")
+    assert main._index_version == 1
+    assert main.answer_cache_get(req(), "m", 1) is None
+
+    # 생성 도중 색인이 바뀐 답변은 저장하지 않음
+    put(req(), version=0)
+    assert len(main._answer_cache) == 0
+    put(req(), version=1)
+    assert main.answer_cache_get(req(), "m", 1) is not None
+
+
+def test_answers_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    put(req())
+    now[0] += 59
+    assert main.answer_cache_get(req(), "m", 0) is not None
+    now[0] += 1
+    assert main.answer_cache_get(req(), "m", 0) is None
+    assert len(main._answer_cache) == 0
+
+
+def test_similar_question_hits_above_threshold(monkeypatch):
+    monkeypatch.setattr(main, "ANSWER_CACHE_SIMILARITY", 0.95)
+    put(req())
+    close = np.array([1.0, 1.0, 1.0, 0.9], dtype=np.float32)
+    far = np.array([1.0, -1.0, 1.0, -1.0], dtype=np.float32)
+    assert main.answer_cache_get(req("RAG란?"), "m", 0) is None
+    assert main.answer_cache_get(req("RAG란?"), "m", 0, far) is None
+    assert main.answer_cache_get(req("RAG란?"), "m", 0, close)["tokens"] == ["answer"]
+    assert main.answer_cache_stats()["semantic_hits"] == 1
+
+
+def test_least_recently_used_answers_are_evicted(monkeypatch):
+    monkeypatch.setattr(main, "ANSWER_CACHE_SIZE", 2)
+    put(req("one"))
+    put(req("two"))
+    main.answer_cache_get(req("one"), "m", 0)
+    put(req("three"))
+    assert main.answer_cache_get(req("two"), "m", 0) is None
+    assert main.answer_cache_get(req("one"), "m", 0) is not None
+    assert main.answer_cache_stats()["evictions"] == 1
@@ -0,0 +1,106 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+
+
+def sentence_chunks(text, **kwargs):
+    return list(main.chunk_segments_by_sentence([(text, {})], **kwargs))
+
+
+def test_no_overlap_only_chunk_before_long_sentence():
+    # 짧은 문장 10개 뒤에 예산을 꽉 채우는 긴 문장: 겹침만으로 된 청크가 생기면 안 됨
+    text = " ".join(f"Short sentence number {i} here." for i in range(10)) + " " + " ".join(["longword"] * 230) + "."
+    chunks = sentence_chunks(text, max_tokens=256, overlap_tokens=32)
+
+    ends = [c["end"] for c in chunks]
+    assert ends == sorted(set(ends)), "every chunk must add text past the previous one"
+    assert sum("number 9" in c["text"] for c in chunks) == 1
+
+
+def test_overlap_carried_between_short_sentences():
+    text = " ".join(f"Sentence {i} is a plain short sentence." for i in range(80))
+    chunks = sentence_chunks(text, max_tokens=64, overlap_tokens=16)
+
+    assert len(chunks) > 1
+    for prev, cur in zip(chunks, chunks[1:]):
+        assert cur["start"] < prev["end"] < cur["end"]
+        assert text[cur["start"]:cur["end"]] == cur["text"]
+
+
+
+def test_chunk_segments_match_chunk_text_on_joined_segments():
+    pages = [f"Page {p} line {i} with some filler words.\r\n" * 3 for p in range(1, 6) for i in range(2)]
+    normalized = [p.replace("\r\n", "\n") for p in pages]
+    joined = "\n".join(normalized)
+    page_starts = [sum(len(p) + 1 for p in normalized[:i]) for i in range(len(normalized))]
+
+    def page_at(offset):
+        return sum(1 for s in page_starts if s <= offset)
+
+    for size, overlap in ((80, 20), (200, 50), (37, 0), (5000, 100)):
+        segments = [(text, {"page": no}) for no, text in enumerate(pages, start=1)]
+        chunks = list(main.chunk_segments(segments, chunk_size=size, overlap=overlap))
+
+        assert [c["text"] for c in chunks] == list(main.chunk_text(joined, size, overlap))
+        for c in chunks:
+            assert joined[c["start"]:c["end"]] == c["text"]
+            assert (c["page_start"], c["page_end"]) == (page_at(c["start"]), page_at(c["end"] - 1))
+
+
+def table_rows_in_range(text, chunk):
+    return [line for line in text[chunk["start"]:chunk["end"]].split("\n") if line.strip()]
+
+
+def test_csv_row_chunks_repeat_header_and_point_into_extracted_text(tmp_path):
+    fp = tmp_path / "parts.csv"
+    rows = ["code,name,qty"] + [f"P-{i},부품 {i},{i}" for i in range(23)]
+    rows.insert(5, ",,")  # 빈 행
+    fp.write_text("\r\n".join(rows), encoding="cp949")
+
+    text = main.read_file_text(fp)
+    chunks = list(main.iter_table_chunks(fp, rows_per_chunk=10, max_chars=10000))
+
+    assert [(c["row_start"], c["row_end"]) for c in chunks] == [(2, 12), (13, 22), (23, 25)]
+    for c in chunks:
+        header, *body = c["text"].split("\n")
+        assert header == "code\tname\tqty"
+        assert body == table_rows_in_range(text, c)
+        assert "sheet" not in c
+
+
+def test_xlsx_row_chunks_per_sheet(tmp_path):
+    from openpyxl import Workbook
+
+    wb = Workbook()
+    first = wb.active
+    first.title = "Stock"
+    first.append(["code", "qty"])
+    for i in range(5):
+        first.append([f"S-{i}", i])
+        if i == 2:
+            first.append([None, None])
+    header_only = wb.create_sheet("Empty")
+    header_only.append(["only", "header"])
+    fp = tmp_path / "stock.xlsx"
+    wb.save(fp)
+
+    text = main.read_file_text(fp)
+    chunks = list(main.iter_table_chunks(fp, rows_per_chunk=3, max_chars=10000))
+
+    assert [(c["sheet"], c["row_start"], c["row_end"]) for c in chunks] == [
+        ("Stock", 2, 4), ("Stock", 6, 7), ("Empty", 1, 1)
+    ]
+    for c in chunks[:2]:
+        assert c["text"].split("\n")[:2] == ["# Sheet: Stock", "code\tqty"]
+        assert c["text"].split("\n")[2:] == table_rows_in_range(text, c)
+    assert text[chunks[2]["start"]:chunks[2]["end"]] == "only\theader"
+
+
+def test_long_rows_split_by_characters(tmp_path):
+    fp = tmp_path / "wide.csv"
+    fp.write_text("h\n" + "\n".join("x" * 40 for _ in range(6)), encoding="utf-8")
+    chunks = list(main.iter_table_chunks(fp, rows_per_chunk=10, max_chars=100))
+    assert [(c["row_start"], c["row_end"]) for c in chunks] == [(2, 3), (4, 5), (6, 7)]
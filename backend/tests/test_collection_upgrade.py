@@ -0,0 +1,64 @@
+import uuid
+
+import main
+from qdrant_client.http.models import Distance, PointStruct, VectorParams
+
+
+def legacy_collection(sources, base_id=1792296082248603):
+    """A collection as the baseline /ingest (integer IDs) and /upload (UUIDs) left it: text in the payload"""
+    client = main.get_qdrant()
+    client.create_collection(main.COLLECTION_NAME, vectors_config=VectorParams(size=4, distance=Distance.COSINE))
+    points = []
+    for n, source in enumerate(sources):
+        for chunk_id in range(3):
+            pid = base_id + n * 10 + chunk_id if n % 2 == 0 else str(uuid.uuid4())
+            points.append(PointStruct(
+                id=pid,
+                vector=[1.0, float(n), float(chunk_id), 0.5],
+                payload={
+                    "source": source,
+                    "filename": source.rsplit("/", 1)[-1],
+                    "chunk_id": chunk_id,
+                    "text": f"{source} chunk {chunk_id}",
+                    "indexed_at": "2024-01-01T00:00:00",
+                },
+            ))
+    client.upsert(main.COLLECTION_NAME, points=points, wait=True)
+    return points
+
+
+def test_upgrade_moves_text_of_integer_id_points(index_state):
+    points = legacy_collection(["/data/a.pdf", "/data/b.txt", "/data/c.csv"])
+
+    main.upgrade_collection()
+
+    client = main.get_qdrant()
+    stored = client.retrieve(main.COLLECTION_NAME, ids=[p.id for p in points], with_payload=True)
+    assert len(stored) == len(points)
+    assert all("text" not in p.payload for p in stored)
+    assert {p.payload["file_type"] for p in stored} == {".pdf", ".txt", ".csv"}
+
+    texts = main.chunk_store_get([str(p.id) for p in points])
+    assert [texts[str(p.id)]["text"] for p in points] == [p.payload["text"] for p in points]
+
+    assert main.catalog_totals() == {"sources": 3, "points": 9, "bytes": 0}
+
+
+def test_legacy_integer_ids_resolve_from_chunk_store_keys(index_state):
+    points = legacy_collection(["/data/a.pdf"])
+    main.upgrade_collection()
+
+    keys = [str(p.id) for p in points]
+    found = main.get_qdrant().retrieve(main.COLLECTION_NAME, ids=main.qdrant_point_ids(keys))
+    assert sorted(p.id for p in found) == sorted(p.id for p in points)
+
+
+def test_catalog_backfill_runs_once(index_state):
+    legacy_collection(["/data/a.pdf", "/data/b.txt"])
+    main.upgrade_collection()
+    assert main.catalog_totals()["sources"] == 2
+
+    # 실패한 인제스트 등으로 개수가 다시 어긋나도 다음 시작에서 컬렉션을 다시 훑지 않음
+    main.manifest_delete(["/data/b.txt"])
+    assert main.backfill_manifest() == 0
+    assert main.catalog_totals()["sources"] == 1
@@ -0,0 +1,52 @@
+import asyncio
+import gzip
+import os
+
+import pytest
+
+import main
+
+
+def store_text(tmp_path, sha256, text="text"):
+    tmp = tmp_path / "spool" / f"{sha256}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        f.write(text)
+    main.document_text_put(sha256, tmp, [])
+
+
+def test_failed_ingest_removes_texts_it_stored(index_state, monkeypatch):
+    monkeypatch.setattr(main, "PARSE_WORKERS", 0)
+    main.create_collection(4)
+
+    def embedding_down(texts, use_cache=True):
+        raise RuntimeError("embedding down")
+
+    monkeypatch.setattr(main, "embed_texts_batch", embedding_down)
+    doc = index_state / "a.txt"
+    doc.write_text("A plain sentence to index. " * 40, encoding="utf-8")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.run_ingest_pipeline([doc]))
+
+    assert main.manifest_get(str(doc)) is None
+    assert list(main.DOC_TEXT_DIR.iterdir()) == []
+    assert list(main.SPOOL_DIR.iterdir()) == []
+
+
+def test_sweep_removes_only_unreferenced_texts_from_before_start(index_state, monkeypatch):
+    store_text(index_state, "a" * 64)
+    store_text(index_state, "b" * 64)
+    main.manifest_put("/data/b.txt", 1, 1.0, "b" * 64, 1)
+    stray = main.DOC_TEXT_DIR / f"{'c' * 64}.txt.gz"
+    stray.write_bytes(b"")
+    os.utime(stray, (0, 0))
+
+    # 이번 프로세스에서 저장된 텍스트는 진행 중인 작업의 것일 수 있으므로 유지
+    assert main.sweep_document_texts() == 1
+    assert main.document_text_exists("a" * 64)
+    assert not stray.exists()
+
+    monkeypatch.setattr(main, "_started_at", main.time.time() + 60)
+    assert main.sweep_document_texts() == 1
+    assert not main.document_text_exists("a" * 64)
+    assert main.document_text_get("b" * 64)[0] == "text"
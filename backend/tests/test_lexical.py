@@ -0,0 +1,41 @@
+import main
+
+
+def index(texts, source="s"):
+    main.lexical_index_put([f"p{i}" for i in range(len(texts))], [{"text": t, "source": source} for t in texts])
+
+
+def test_lexical_terms_split_hangul_into_bigrams_and_keep_codes_whole():
+    terms = main.lexical_terms("제품번호 AB-1234X 검색")
+    assert terms == ["제품", "품번", "번호", "ab-1234x", "ab", "1234x", "검색"]
+    assert main.lexical_terms("Ｚ９") == ["z9"]  # NFKC
+    assert main.lexical_terms("가") == ["가"]
+
+
+def test_rrf_fuse_rewards_agreement_between_rankings():
+    dense = ["a", "b", "c", "d"]
+    lexical = ["c", "x"]
+    assert main.rrf_fuse([dense, lexical], 2) == ["c", "a"]
+    assert main.rrf_fuse([dense], 2) == ["a", "b"]
+    assert main.rrf_fuse([[], []], 5) == []
+
+
+def test_exact_code_found_on_small_index(index_state):
+    index(["부품 ZX-9981Q 교체", "ZX-9981Q 점검", "기타 ZX-9981Q", "무관한 문서", "무관한 글", "다른 문서"])
+    hits = main.lexical_search("ZX-9981Q", 5)
+    assert {pid for pid, _ in hits} == {"p0", "p1", "p2"}
+
+
+def test_common_terms_only_rerank_chunks_matched_by_rarer_terms(index_state, monkeypatch):
+    monkeypatch.setattr(main, "LEXICAL_MAX_POSTINGS", 5)
+    index([f"what is the answer to item w{i}" + (" the the" if i == 3 else "") for i in range(20)])
+
+    hits = main.lexical_search("what is the w3", 5)
+    assert [pid for pid, _ in hits] == ["p3"]
+    assert main.lexical_search("what is the", 5) == []
+
+
+def test_source_filter(index_state):
+    index(["alpha beta"], source="one")
+    main.lexical_index_put(["q0"], [{"text": "alpha gamma", "source": "two"}])
+    assert [pid for pid, _ in main.lexical_search("alpha", 5, ["two"])] == ["q0"]
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def limits(monkeypatch):
+    monkeypatch.setattr(main, "LLM_CONCURRENCY", 1)
+    monkeypatch.setattr(main, "LLM_MODEL_CONCURRENCY", {"wide": 2})
+    monkeypatch.setattr(main, "LLM_QUEUE_MAX", 2)
+    monkeypatch.setattr(main, "LLM_QUEUE_TIMEOUT", 5)
+
+
+def test_full_queue_rejects_with_429():
+    async def scenario():
+        s = main.LLMScheduler()
+        tickets = [s.admit("m") for _ in range(3)]  # 실행 1 + 대기 2
+        with pytest.raises(HTTPException) as exc:
+            s.admit("m")
+        assert exc.value.status_code == 429 and exc.value.headers["Retry-After"]
+        s.admit("other")  # 모델별 대기열
+        s.release(tickets[0])
+        s.admit("m")
+        return s.snapshot()
+
+    snap = asyncio.run(scenario())
+    assert snap["rejected"] == 1
+    assert snap["models"]["m"] == {"limit": 1, "active": 1, "waiting": 2, "waiting_batch": 0}
+
+
+def test_interactive_waiters_go_before_batch_then_arrival_order():
+    async def scenario():
+        s = main.LLMScheduler()
+        running = s.admit("wide")
+        s.admit("wide")
+        batch = s.admit("wide", "batch")
+        first = s.admit("wide")
+        assert [s.position(t) for t in (batch, first)] == [2, 1]
+        order = []
+        for t in (batch, first):
+            t.granted.add_done_callback(lambda _, t=t: order.append(t))
+        s.release(running)
+        await asyncio.sleep(0)
+        assert order == [first] and s.position(first) == 0
+
+    asyncio.run(scenario())
+
+
+def test_wait_turn_reports_positions_and_times_out(monkeypatch):
+    monkeypatch.setattr(main, "LLM_QUEUE_TIMEOUT", 0.05)
+
+    async def scenario():
+        s = main.LLMScheduler()
+        s.admit("m")
+        waiting = s.admit("m")
+        positions = []
+        with pytest.raises(HTTPException) as exc:
+            async for position in s.wait_turn(waiting):
+                positions.append(position)
+        s.release(waiting)
+        return positions, exc.value.status_code, s.snapshot()
+
+    positions, status, snap = asyncio.run(scenario())
+    assert positions == [1] and status == 503
+    assert snap["timed_out"] == 1 and snap["models"]["m"]["waiting"] == 0
+
+
+def test_released_slot_is_handed_to_the_waiter():
+    async def scenario():
+        s = main.LLMScheduler()
+        running = s.admit("m")
+        waiting = s.admit("m")
+
+        async def wait():
+            return [p async for p in s.wait_turn(waiting)]
+
+        task = asyncio.create_task(wait())
+        await asyncio.sleep(0.01)
+        s.release(running)
+        return await asyncio.wait_for(task, 1), s.snapshot()
+
+    positions, snap = asyncio.run(scenario())
+    assert positions == [1]
+    assert snap["models"]["m"]["active"] == 1 and snap["admitted"] == 2
@@ -0,0 +1,126 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+import main
+
+
+def write(fp, text, mtime=None):
+    fp.write_text(text, encoding="utf-8")
+    if mtime is not None:
+        os.utime(fp, (mtime, mtime))
+    return fp
+
+
+def record(fp, chunks):
+    st = fp.stat()
+    main.manifest_put(str(fp), st.st_size, st.st_mtime, main.file_sha256(fp), chunks)
+
+
+def index_points(fp, chunks):
+    source = str(fp)
+    ids = [main.point_id(source, i) for i in range(chunks)]
+    payloads = [{"source": source, "filename": fp.name, "chunk_id": i, "text": f"chunk {i}"} for i in range(chunks)]
+    main.upsert_vectors(ids, np.ones((chunks, 4), dtype=np.float32), payloads)
+
+
+def point_count():
+    return main.get_qdrant().count(main.COLLECTION_NAME, exact=True).count
+
+
+def test_plan_ingest_delta(index_state):
+    new = write(index_state / "new.txt", "new")
+    same = write(index_state / "same.txt", "same", mtime=1_000_000)
+    touched = write(index_state / "touched.txt", "touched", mtime=1_000_000)
+    edited = write(index_state / "edited.txt", "edited", mtime=1_000_000)
+    for fp in (same, touched, edited):
+        record(fp, 3)
+    os.utime(touched, (2_000_000, 2_000_000))
+    write(edited, "edited again", mtime=2_000_000)
+
+    changed, unchanged = main.plan_ingest_delta([new, same, touched, edited])
+
+    assert unchanged == 2
+    assert [(e["path"], e["previous_chunks"]) for e in changed] == [(new, None), (edited, 3)]
+    assert changed[1]["previous_sha256"] != changed[1]["sha256"] == main.file_sha256(edited)
+    assert main.manifest_get(str(touched))["mtime"] == 2_000_000
+
+
+def test_plan_ingest_delta_skips_hashing_of_unchanged_and_reuses_known_hashes(index_state, monkeypatch):
+    same = write(index_state / "same.txt", "same")
+    record(same, 1)
+    upload = write(index_state / "upload.txt", "uploaded")
+
+    def no_hashing(fp, block_size=0):
+        raise AssertionError(f"hashed {fp}")
+
+    monkeypatch.setattr(main, "file_sha256", no_hashing)
+    changed, unchanged = main.plan_ingest_delta([same, upload], {str(upload): "f" * 64})
+    assert unchanged == 1
+    assert [e["sha256"] for e in changed] == ["f" * 64]
+
+
+def test_backfilled_rows_are_reindexed_by_source(index_state):
+    fp = write(index_state / "legacy.txt", "legacy")
+    main.manifest_backfill({str(fp): 4}, {})
+
+    changed, _ = main.plan_ingest_delta([fp])
+    assert changed[0]["previous_chunks"] is None
+
+
+@pytest.fixture
+def collection(index_state):
+    main.create_collection(4)
+
+
+def test_prune_deleted_files(index_state, collection):
+    kept = write(index_state / "kept.txt", "kept")
+    gone = write(index_state / "gone.txt", "gone")
+    legacy = index_state / "legacy.txt"
+    for fp, n in ((kept, 2), (gone, 3)):
+        index_points(fp, n)
+        record(fp, n)
+    index_points(legacy, 2)
+    main.manifest_backfill({str(legacy): 2}, {})
+    gone.unlink()
+
+    assert main.prune_deleted_files(index_state, {str(kept)}) == 2
+    assert point_count() == 2
+    assert main.manifest_get(str(gone)) is None and main.manifest_get(str(legacy)) is None
+    assert main.manifest_get(str(kept))["chunk_count"] == 2
+    assert set(main.chunk_store_get([main.point_id(str(kept), 0), main.point_id(str(gone), 0)])) == {main.point_id(str(kept), 0)}
+
+
+def test_finalize_file_drops_points_of_a_longer_previous_version(index_state, collection):
+    fp = write(index_state / "doc.txt", "long version")
+    index_points(fp, 5)
+    record(fp, 5)
+    write(fp, "short")
+    changed, _ = main.plan_ingest_delta([fp])
+    index_points(fp, 2)
+
+    main.finalize_file(changed[0], 2)
+
+    assert point_count() == 2
+    assert main.manifest_get(str(fp))["chunk_count"] == 2
+    assert main.plan_ingest_delta([fp]) == ([], 1)
+
+
+def test_failed_parse_keeps_previous_version(index_state, collection, monkeypatch):
+    fp = write(index_state / "doc.txt", "first version")
+    index_points(fp, 3)
+    record(fp, 3)
+    write(fp, "second version, locked while parsing")
+
+    async def parse_failed(fp, retries=1, text_path=None):
+        return None
+
+    monkeypatch.setattr(main, "parse_file", parse_failed)
+    stats = asyncio.run(main.run_ingest_pipeline([fp]))
+
+    assert stats["files"] == 0
+    assert main.manifest_get(str(fp))["chunk_count"] == 3
+    assert point_count() == 3
+    assert len(main.plan_ingest_delta([fp])[0]) == 1  # 다음 인제스트에서 다시 시도
@@ -0,0 +1,80 @@
+import asyncio
+import json
+
+import httpx
+
+import main
+
+
+def test_generate_request_sends_the_window_the_prompt_was_packed_for(monkeypatch):
+    monkeypatch.setattr(main, "LLM_MODEL_CONTEXT", {"big:8b": 8192})
+    monkeypatch.setattr(main, "_ollama_available", True)
+    sent = []
+
+    def handler(request):
+        sent.append(json.loads(request.content))
+        return httpx.Response(200, text=json.dumps({"response": "ok", "done": True}) + "\n")
+
+    async def generate(model):
+        monkeypatch.setattr(main, "_ollama_client", httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://ollama"))
+        return [t async for t in main.call_ollama_stream("prompt", model, "system")]
+
+    assert asyncio.run(generate("big:8b")) == ["ok"]
+    assert asyncio.run(generate("other:7b")) == ["ok"]
+    assert [p["options"]["num_ctx"] for p in sent] == [8192, main.LLM_CONTEXT_TOKENS]
+    assert main.model_context_window("big:8b") == 8192
+
+
+def ctx(source, chunk_id, text, score, **extra):
+    return {"payload": {"source": source, "filename": source, "chunk_id": chunk_id, "text": text, **extra}, "score": score}
+
+
+def test_pack_contexts_merges_consecutive_chunks_without_repeating_overlap():
+    doc = "Alpha beta gamma. Delta epsilon zeta. Eta theta iota. Kappa lambda mu."
+    contexts = [
+        ctx("a.txt", 1, doc[18:54], 0.7, char_start=18, char_end=54),
+        ctx("a.txt", 0, doc[0:36], 0.9, char_start=0, char_end=36),
+        ctx("a.txt", 3, doc[54:], 0.4, char_start=54, char_end=len(doc)),
+        ctx("b.txt", 0, "Other document.", 0.8),
+    ]
+    passages, stats = main.pack_contexts(contexts, budget=1000)
+
+    assert [(p["filename"], p["text"], p["chunks"], p["score"]) for p in passages] == [
+        ("a.txt", doc[0:54], 2, 0.9),
+        ("b.txt", "Other document.", 1, 0.8),
+        ("a.txt", doc[54:], 1, 0.4),
+    ]
+    assert stats["chunks_merged"] == 1 and stats["chunks_dropped"] == 0
+
+
+def test_merge_without_offsets_finds_the_overlap_in_the_text():
+    shared = "a shared tail that is longer than the probe"
+    prev = {"text": "The first chunk ends with " + shared}
+    assert main.merge_chunk_texts(prev, {"text": shared + " and then goes on"}) == (
+        "The first chunk ends with " + shared + " and then goes on"
+    )
+    assert main.merge_chunk_texts(prev, {"text": "Unrelated"}) == prev["text"] + "\nUnrelated"
+
+
+def test_table_chunks_are_never_merged():
+    contexts = [ctx("t.csv", i, f"h\nrow {i}", 0.5, row_start=i + 2, row_end=i + 2) for i in range(3)]
+    passages, _ = main.pack_contexts(contexts, budget=1000)
+    assert len(passages) == 3
+
+
+def test_pack_contexts_fills_the_budget_by_score():
+    long_text = " ".join(["word"] * 400)
+    contexts = [
+        ctx("low.txt", 0, long_text, 0.1),
+        ctx("long.txt", 0, long_text, 0.8),
+        ctx("short.txt", 0, "A short but relevant passage.", 0.9),
+    ]
+    budget = 200
+    passages, stats = main.pack_contexts(contexts, budget)
+
+    # 가장 관련 있는 구절부터 채우고, 넘치는 구절은 잘라서 넣고, 남은 자리가 작으면 버림
+    assert [p["filename"] for p in passages] == ["short.txt", "long.txt"]
+    assert long_text.startswith(passages[1]["text"]) and len(passages[1]["text"]) < len(long_text)
+    assert stats["context_tokens"] == sum(main.count_tokens([p["text"] for p in passages]))
+    assert stats["context_tokens"] <= budget
+    assert stats["chunks_dropped"] == 1
@@ -26,11 +26,11 @@ export default function DashboardPage() {
 
   useEffect(() => {
     // 백엔드에서 통계 데이터 가져오기
-    fetch("/api/vectors")
+    fetch("/api/vectors?limit=1")
       .then((res) => res.json())
       .then((data) => {
         setStats({
-          totalDocuments: data.sources?.length || 0,
+          totalDocuments: data.total_sources ?? data.sources?.length ?? 0,
           totalQueries: 0,
           avgResponseTime: 1.2,
         });